@@ -6,10 +6,92 @@
 import logging
 
 
+# the subclasses of element classes for lazy reading, by element class; not
+# kept on the element classes since modifying classes slows down attribute
+# access on their instances
+_lazy_classes = {}
+
+
+class FHIRPropertyTable(object):
+    """ The properties of a FHIR element class, built once per class from
+    the properties its superclasses and itself declare. Not to be modified.
+    """
+
+    def __init__(self, properties, slots=(), from_json=False, as_json=False):
+        self.properties = tuple(properties)
+        """ Tuples of ("name", "json_name", type, is_list, "of_many", not_optional),
+        in declaration order. """
+
+        self.by_json_key = {}
+        """ Maps JSON keys to (name, type, is_list, of_many, with_owner)
+        tuples, `with_owner` telling whether `type` instantiates elements. """
+
+        self.by_name = {}
+        """ Maps property names to their JSON keys. """
+
+        for name, jsname, typ, is_list, of_many, not_optional in self.properties:
+            self.by_json_key[jsname] = (name, typ, is_list, of_many, hasattr(typ, 'with_json_and_owner'))
+            self.by_name[name] = jsname
+
+        self.choice_groups = frozenset([prop[4] for prop in self.properties if prop[4] is not None])
+        """ The names of choice groups, like "value" for "valueString". """
+
+        self.required_keys = frozenset([prop[4] or prop[1] for prop in self.properties if prop[5]])
+        """ The JSON keys, or choice groups, that must be present. """
+
+        self.required = tuple([(key, tuple([prop[1] for prop in self.properties if (prop[4] or prop[1]) == key]))
+            for key in sorted(self.required_keys)])
+        """ Tuples of (required key or choice group, "json_keys") where one of
+        the JSON keys must be present. """
+
+        self.names = frozenset([prop[0] for prop in self.properties])
+        """ The names of all properties. """
+
+        self.slots = tuple([prop[0] for prop in self.properties if prop[0] in slots])
+        """ The properties kept in `__slots__`, which are set to `None` when
+        instantiating. """
+
+        self.from_json = from_json
+        """ Whether all classes declaring properties also generated their
+        `_from_json()`. """
+
+        self.as_json = as_json
+        """ Whether all classes declaring properties also generated their
+        `_as_json()`. """
+
+    def found_keys(self, jsondict):
+        """ The keys of the JSON dictionary that are accounted for, including
+        "_name" keys of primitives and the choice groups of found keys.
+        """
+        found = set(['resourceType', 'fhir_comments'])
+        for jsname in jsondict:
+            prop = self.by_json_key.get(jsname)
+            if prop is not None:
+                found.add(jsname)
+                found.add('_'+jsname)
+                if prop[3] is not None:
+                    found.add(prop[3])
+        return found
+
+    def missing_keys(self, jsondict):
+        """ The required keys, or choice groups, missing from the JSON
+        dictionary, be it read or serialized.
+        """
+        return [key for key, jsnames in self.required if not any(jsname in jsondict for jsname in jsnames)]
+
+
 class FHIRAbstractBase(object):
     """ Abstract base class for all FHIR elements.
+
+    Generated classes may keep their properties in `__slots__` (see the
+    `resource_slots` setting) rather than setting them to `None` in their
+    own `__init__`.
+
+    Elements read lazily are instances of a subclass, see `lazy_class()`.
     """
 
+    __slots__ = ('_resolved', '_owner')
+
     def __init__(self, jsondict=None, cast=False):
 
         self._resolved = None
@@ -18,6 +100,9 @@ class FHIRAbstractBase(object):
         self._owner = None
         """ Points to the parent resource, if there is one. """
 
+        for name in type(self).propertyTable().slots:
+            setattr(self, name, None)
+
         if jsondict is not None:
             self.update_with_json(jsondict, cast)
 
@@ -25,7 +110,7 @@ class FHIRAbstractBase(object):
     # MARK: Instantiation from JSON
 
     @classmethod
-    def with_json(cls, jsonobj, cast=False):
+    def with_json(cls, jsonobj, cast=False, lazy=False):
         """ Initialize an element from a JSON dictionary or array.
 
         If the JSON dictionary has a "resourceType" entry and the specified
@@ -33,25 +118,50 @@ class FHIRAbstractBase(object):
         `FHIRElementFactory` to return a correct class instance.
 
         :param jsonobj: A dict or list of dicts to instantiate from
+        :param bool lazy: Whether to only instantiate child elements when
+            they are first accessed, see `update_with_json()`; the instances
+            keep referring to `jsonobj`, which must not be modified then
         :returns: An instance or a list of instances created from JSON data
         """
         if isinstance(jsonobj, dict):
-            return cls._with_json_dict(jsonobj, cast)
+            return cls._with_json_dict(jsonobj, cast, lazy)
 
         arr = []
         for jsondict in jsonobj:
-            arr.append(cls._with_json_dict(jsondict, cast))
+            arr.append(cls._with_json_dict(jsondict, cast, lazy))
         return arr
 
     @classmethod
-    def _with_json_dict(cls, jsondict, cast=False):
+    def _with_json_dict(cls, jsondict, cast=False, lazy=False):
         if not isinstance(jsondict, dict):
             raise Exception("Cannot use this method with anything but a JSON dictionary, got {}"
                 .format(jsondict))
+        if lazy:
+            instance = cls.lazy_class()(None, cast)
+            instance.update_with_json(jsondict, cast, lazy)
+            return instance
         return cls(jsondict, cast)
 
     @classmethod
-    def with_json_and_owner(cls, jsonobj, owner, cast=False):
+    def lazy_class(cls):
+        """ The subclass, created on first use, whose instances can be read
+        lazily; it mixes in `FHIRLazyElement`.
+        """
+        if issubclass(cls, FHIRLazyElement):
+            return cls
+        klass = _lazy_classes.get(cls)
+        if klass is None:
+            klass = type(cls.__name__, (FHIRLazyElement, cls), {
+                '__slots__': ('_lazy',),
+                '__module__': cls.__module__,
+                '__doc__': cls.__doc__,
+                '_property_table': cls.propertyTable(),
+            })
+            _lazy_classes[cls] = klass
+        return klass
+
+    @classmethod
+    def with_json_and_owner(cls, jsonobj, owner, cast=False, lazy=False):
         """ Instantiates by forwarding to `with_json()`, then remembers the
         "owner" of the instantiated elements. The "owner" is the resource
         containing the receiver and is used to resolve contained resources.
@@ -60,7 +170,7 @@ class FHIRAbstractBase(object):
         :param FHIRElement owner: The owning parent
         :returns: An instance or a list of instances created from JSON data
         """
-        instance = cls.with_json(jsonobj, cast)
+        instance = cls.with_json(jsonobj, cast, lazy)
         if isinstance(instance, list):
             for inst in instance:
                 inst._owner = owner
@@ -72,15 +182,76 @@ class FHIRAbstractBase(object):
 
     # MARK: (De)Serialization
 
+    @classmethod
+    def propertyTable(cls):
+        """ Returns the `FHIRPropertyTable` of the class, built on first use
+        from the `_declared_properties()` of the class and its superclasses.
+
+        Classes overriding `elementProperties()` get their table from the
+        override instead, called on an uninitialized instance, and are read
+        and serialized with the generic loops.
+        """
+        table = cls.__dict__.get('_property_table')
+        if table is None:
+            slots = set()
+            for klass in cls.__mro__:
+                names = klass.__dict__.get('__slots__', ())
+                slots.update([names] if isinstance(names, str) else names)
+            if cls.elementProperties is not FHIRAbstractBase.elementProperties:
+                table = FHIRPropertyTable(cls.__new__(cls).elementProperties(), slots)
+            else:
+                declaring = [klass for klass in reversed(cls.__mro__) if '_declared_properties' in klass.__dict__]
+                properties = [prop for klass in declaring for prop in klass._declared_properties()]
+                table = FHIRPropertyTable(properties, slots,
+                    all('_from_json' in klass.__dict__ for klass in declaring),
+                    all('_as_json' in klass.__dict__ for klass in declaring))
+            cls._property_table = table
+        return table
+
+    @staticmethod
+    def _declared_properties():
+        """ Returns a list of tuples, one tuple for each property the class
+        itself (not its superclasses) adds, as:
+        ("name", "json_name", type, is_list, "of_many", not_optional)
+        """
+        return []
+
+    def _from_json(self, jsondict, cast):
+        """ Generated classes may implement this to set the properties they
+        declare from JSON, faster than the generic loop in
+        `update_with_json()`.
+
+        :returns: The number of JSON keys that were used
+        """
+        return 0
+
     def elementProperties(self):
         """ Returns a list of tuples, one tuple for each property that should
         be serialized, as: ("name", "json_name", type, is_list, "of_many", not_optional)
+
+        Subclasses may override this to add properties, extending the list
+        returned by `super()`; see `propertyTable()`.
         """
-        return []
+        declaring = [klass for klass in reversed(type(self).__mro__) if '_declared_properties' in klass.__dict__]
+        return [prop for klass in declaring for prop in klass._declared_properties()]
 
-    def update_with_json(self, jsondict, cast=False):
+    def update_with_json(self, jsondict, cast=False, lazy=False):
         """ Update the receiver with data in a JSON dictionary.
+
+        When reading lazily, which needs an instance of `lazy_class()`, the
+        receiver keeps the JSON dictionary and only sets primitive
+        properties. Properties holding elements stay unset until first
+        accessed, when they are instantiated lazily as well; warnings about
+        their JSON are logged then. Until then, `as_json()` returns their
+        JSON as it was.
+
+        Nothing is copied: the JSON passed through by `as_json()` is the very
+        dictionaries and lists in `jsondict`, so modifying the serialized
+        JSON, or `jsondict` itself, also changes what the receiver's
+        properties are instantiated from later on.
         """
+        if lazy and not isinstance(self, FHIRLazyElement):
+            raise Exception("Only instances of `lazy_class()` can be read lazily, use `with_json()`")
         if jsondict is None:
             return
         if not isinstance(jsondict, dict):
@@ -88,73 +259,118 @@ class FHIRAbstractBase(object):
                 .format(type(jsondict), type(self)))
             return
 
-        # loop all registered properties and instantiate
-        found = set(['resourceType', 'fhir_comments'])
-        nonoptionals = set()
-        for name, jsname, typ, is_list, of_many, not_optional in self.elementProperties():
-            if not jsname in jsondict:
-                if not_optional:
-                    nonoptionals.add(of_many or jsname)
+        table = self.propertyTable()
+        if lazy:
+            self._lazy = (jsondict, cast)
+            found = set(['resourceType', 'fhir_comments'])
+            self._from_json_with_table(table, jsondict, cast, found, lazy)
+        elif table.from_json:
+            used = self._from_json(jsondict, cast) + ('resourceType' in jsondict) + ('fhir_comments' in jsondict)
+            found = table.found_keys(jsondict) if used < len(jsondict) else None
+        else:
+            found = set(['resourceType', 'fhir_comments'])
+            self._from_json_with_table(table, jsondict, cast, found)
+
+        # were there missing non-optional entries?
+        if found is None:
+            missing = table.missing_keys(jsondict) if table.required else ()
+        else:
+            missing = table.required_keys - found
+        for miss in missing:
+            logging.warning("Non-optional property '{}' on {} is missing from JSON"
+                .format(miss, self))
+
+        # were there superfluous dictionary keys? (with all keys used, there are none)
+        if found is not None and len(set(jsondict.keys()) - found) > 0:
+            for supflu in set(jsondict.keys()) - found:
+                logging.warning("Superfluous entry '{}' in JSON for {}"
+                    .format(supflu, self))
+
+    def _from_json_with_table(self, table, jsondict, cast, found, lazy=False):
+        """ Loops all entries with a registered property and instantiates,
+        adding the keys used to `found`. When lazy, properties holding
+        elements are unset instead.
+        """
+        for jsname, value in jsondict.items():
+            prop = table.by_json_key.get(jsname)
+            if prop is None:
                 continue
+            name, typ, is_list, of_many, with_owner = prop
 
-            if not is_list and isinstance(jsondict[jsname], list):
+            if not is_list and isinstance(value, list):
                 raise TypeError("The field '%s' must not be a list" % jsname)
-            if is_list and not isinstance(jsondict[jsname], list):
+            if is_list and not isinstance(value, list):
                 raise TypeError("The field '%s' must be a list" % jsname)
 
-            if hasattr(typ, 'with_json_and_owner'):
-                setattr(self, name, typ.with_json_and_owner(jsondict[jsname], self, cast))
+            if with_owner and lazy and isinstance(value, (dict, list)) and len(value) > 0:
+                try:
+                    delattr(self, name)     # instantiated on first access, see `__getattr__`
+                except AttributeError:
+                    pass
+            elif with_owner:
+                setattr(self, name, typ.with_json_and_owner(value, self, cast))
             else:
-                setattr(self, name, self._cast(jsondict[jsname], typ, is_list) if cast else jsondict[jsname])
+                setattr(self, name, self._cast(value, typ, is_list) if cast else value)
                 # TODO: look at `_name` if this is a primitive
             found.add(jsname)
             found.add('_'+jsname)
             if of_many is not None:
                 found.add(of_many)
 
-        # were there missing non-optional entries?
-        if len(nonoptionals - found) > 0:
-            for miss in nonoptionals - found:
-                logging.warning("Non-optional property '{}' on {} is missing from JSON"
-                    .format(miss, self))
-
-        # were there superfluous dictionary keys?
-        if len(set(jsondict.keys()) - found) > 0:
-            for supflu in set(jsondict.keys()) - found:
-                logging.warning("Superfluous entry '{}' in JSON for {}"
-                    .format(supflu, self))
+    def as_json(self, warn_nonoptionals=True):
+        """ Serializes to JSON by inspecting the property table and creating
+        a JSON dictionary of all registered properties, or with the class'
+        own `_as_json()` if it has one.
 
-    def as_json(self):
-        """ Serializes to JSON by inspecting `elementProperties()` and creating
-        a JSON dictionary of all registered properties.
+        :param bool warn_nonoptionals: Whether to log a warning for every
+            non-optional property without a value, here and in all children
         """
-        js = {}
+        table = self.propertyTable()
+        if table.as_json:
+            js = self._as_json(warn_nonoptionals)
+        else:
+            js = self._as_json_with_table(table, warn_nonoptionals)
 
-        # JSONify all registered properties
-        found = set()
-        nonoptionals = set()
-        for name, jsname, typ, is_list, of_many, not_optional in self.elementProperties():
-            if not_optional:
-                nonoptionals.add(of_many or jsname)
+        # any missing non-optionals?
+        if warn_nonoptionals and table.required:
+            for nonop in table.missing_keys(js):
+                logging.warning("Element '{}' is not optional, you should provide a value for it on {}"
+                    .format(nonop, self))
+        return js
 
-            val = getattr(self, name)
+    def _as_json_with_table(self, table, warn_nonoptionals, source=None):
+        """ Serializes all properties in the property table. Properties not
+        instantiated yet from `source`, the JSON of a lazily read element,
+        are passed through as they are.
+        """
+        js = {}
+        for name, jsname, typ, is_list, of_many, not_optional in table.properties:
+            if source is None:
+                val = getattr(self, name)
+            else:
+                try:
+                    val = object.__getattribute__(self, name)   # without instantiating
+                except AttributeError:
+                    js[jsname] = source[jsname]
+                    continue
             if val is None:
                 continue
             if is_list:
                 if len(val) > 0:
-                    found.add(of_many or jsname)
-                    js[jsname] = [v.as_json() if hasattr(v, 'as_json') else v for v in val]
+                    js[jsname] = [v.as_json(warn_nonoptionals) if hasattr(v, 'as_json') else v for v in val]
             else:
-                found.add(of_many or jsname)
-                js[jsname] = val.as_json() if hasattr(val, 'as_json') else val
-
-        # any missing non-optionals?
-        if len(nonoptionals - found) > 0:
-            for nonop in nonoptionals - found:
-                logging.warning("Element '{}' is not optional, you should provide a value for it on {}"
-                    .format(nonop, self))
+                js[jsname] = val.as_json(warn_nonoptionals) if hasattr(val, 'as_json') else val
         return js
 
+    def _as_json(self, warn_nonoptionals):
+        """ Generated classes may implement this to serialize all their
+        properties, including inherited ones, without inspecting the property
+        table.
+
+        :returns: The JSON dictionary, without checking non-optionals
+        """
+        return {}
+
     def _cast(self, value, typ, is_list=False):
         if value is None:
             return None
@@ -217,3 +433,57 @@ class FHIRAbstractBase(object):
             self._resolved[refid] = resolved
         else:
             self._resolved = {refid: resolved}
+
+
+class FHIRLazyElement(object):
+    """ Mixed into the subclasses of element classes whose instances are
+    read lazily: they keep their JSON and instantiate the properties holding
+    elements, left unset, when first accessed.
+
+    Only these subclasses implement `__getattr__`, as it slows down all
+    attribute access.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, jsondict=None, cast=False):
+        self._lazy = None
+        """ The JSON dictionary and `cast` flag, once read. """
+
+        super(FHIRLazyElement, self).__init__(jsondict, cast)
+
+    def __getattr__(self, name):
+        """ Only called for unset attributes.
+        """
+        lazy = self._lazy if '_lazy' != name else None      # unset before reading JSON
+        if lazy is not None:
+            table = self.propertyTable()
+            jsname = table.by_name.get(name)
+            if jsname is not None and jsname in lazy[0]:
+                jsondict, cast = lazy
+                value = table.by_json_key[jsname][1].with_json_and_owner(jsondict[jsname], self, cast, True)
+                setattr(self, name, value)
+                return value
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+
+    def _as_json(self, warn_nonoptionals):
+        """ Serializes with the property table, to pass the JSON of
+        properties not instantiated yet through as it is.
+        """
+        return self._as_json_with_table(self.propertyTable(), warn_nonoptionals)
+
+    def _as_json_with_table(self, table, warn_nonoptionals, source=None):
+        source = self._lazy[0] if self._lazy is not None else None
+        return super(FHIRLazyElement, self)._as_json_with_table(table, warn_nonoptionals, source)
+
+    def __reduce_ex__(self, protocol):
+        """ Pickles with the element class, as classes created at runtime
+        cannot be pickled.
+        """
+        reduced = super(FHIRLazyElement, self).__reduce_ex__(max(2, protocol))
+        return (_lazy_instance, (type(self).__bases__[1],)) + tuple(reduced[2:])
+
+
+def _lazy_instance(cls):
+    klass = cls.lazy_class()
+    return klass.__new__(klass)
@@ -0,0 +1,516 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import sys
+import copy
+import types
+import logging
+import pickle
+import unittest
+import importlib.util
+
+from Python import fhirabstractbase
+
+
+class ElementFactory(object):
+    """ Instantiates the resources below, like the generated
+    `FHIRElementFactory`.
+    """
+
+    @staticmethod
+    def get_class(resource_type):
+        return {"Holder": Holder, "Other": Other}.get(resource_type)
+
+    @classmethod
+    def instantiate(cls, resource_type, jsondict):
+        klass = cls.get_class(resource_type)
+        return klass(jsondict) if klass is not None else None
+
+
+factory = types.ModuleType('fhirelementfactory')
+factory.FHIRElementFactory = ElementFactory
+
+# the factory is generated along with the models, so may not be here
+if importlib.util.find_spec('Python.fhirelementfactory') is None:
+    sys.modules['Python.fhirelementfactory'] = factory
+
+from Python import fhirabstractresource
+
+
+class Thing(fhirabstractbase.FHIRAbstractBase):
+    """ A generated-style class declaring its properties.
+    """
+
+    def __init__(self, jsondict=None, cast=False):
+        self.name = None
+        super(Thing, self).__init__(jsondict, cast)
+
+    @staticmethod
+    def _declared_properties():
+        return [
+            ("name", "name", str, False, None, True),
+        ]
+
+    def _from_json(self, jsondict, cast):
+        used = super(Thing, self)._from_json(jsondict, cast)
+        if "name" in jsondict:
+            self.name = jsondict["name"]
+            used += 1
+        return used
+
+    def _as_json(self, warn_nonoptionals):
+        js = {}
+        if self.name is not None:
+            js["name"] = self.name
+        return js
+
+
+class ExtendedThing(Thing):
+    """ A subclass adding a property by overriding `elementProperties()`.
+    """
+
+    def __init__(self, jsondict=None, cast=False):
+        self.label = None
+        super(ExtendedThing, self).__init__(jsondict, cast)
+
+    def elementProperties(self):
+        js = super(ExtendedThing, self).elementProperties()
+        js.extend([
+            ("label", "label", str, False, None, False),
+        ])
+        return js
+
+
+class SlottedThing(fhirabstractbase.FHIRAbstractBase):
+    """ A class generated with `resource_slots`, without `__init__`.
+    """
+    __slots__ = {
+        "name": """ The name. """,
+        "size": """ The size. """,
+    }
+
+    @staticmethod
+    def _declared_properties():
+        return [
+            ("name", "name", str, False, None, False),
+            ("size", "size", int, False, None, False),
+        ]
+
+
+class MySlottedThing(SlottedThing):
+    """ A plain subclass, which has a `__dict__`.
+    """
+    pass
+
+
+class Part(fhirabstractbase.FHIRAbstractBase):
+    """ An element with a primitive and a child element of its own class.
+    """
+
+    def __init__(self, jsondict=None, cast=False):
+        self.text = None
+        self.part = None
+        super(Part, self).__init__(jsondict, cast)
+
+    @staticmethod
+    def _declared_properties():
+        return [
+            ("text", "text", str, False, None, False),
+            ("part", "part", Part, False, None, False),
+        ]
+
+
+class Whole(fhirabstractbase.FHIRAbstractBase):
+    """ A generated-style class with primitive, list and element properties.
+    """
+
+    def __init__(self, jsondict=None, cast=False):
+        self.name = None
+        self.tags = None
+        self.part = None
+        self.parts = None
+        super(Whole, self).__init__(jsondict, cast)
+
+    @staticmethod
+    def _declared_properties():
+        return [
+            ("name", "name", str, False, None, False),
+            ("tags", "tags", str, True, None, False),
+            ("part", "part", Part, False, None, False),
+            ("parts", "parts", Part, True, None, False),
+        ]
+
+    def _from_json(self, jsondict, cast):
+        used = super(Whole, self)._from_json(jsondict, cast)
+        if "name" in jsondict:
+            self.name = jsondict["name"]
+            used += 1
+        if "tags" in jsondict:
+            self.tags = jsondict["tags"]
+            used += 1
+        if "part" in jsondict:
+            self.part = Part.with_json_and_owner(jsondict["part"], self, cast)
+            used += 1
+        if "parts" in jsondict:
+            self.parts = Part.with_json_and_owner(jsondict["parts"], self, cast)
+            used += 1
+        return used
+
+    def _as_json(self, warn_nonoptionals):
+        js = {}
+        if self.name is not None:
+            js["name"] = self.name
+        if self.tags:
+            js["tags"] = list(self.tags)
+        if self.part is not None:
+            js["part"] = self.part.as_json(warn_nonoptionals)
+        if self.parts:
+            js["parts"] = [item.as_json(warn_nonoptionals) for item in self.parts]
+        return js
+
+
+WHOLE = {
+    "name": "w",
+    "tags": ["a", "b"],
+    "part": {"text": "p", "part": {"text": "pp"}},
+    "parts": [{"text": "1"}, {"text": "2", "part": {"text": "2.1"}}],
+}
+
+
+class Holder(fhirabstractresource.FHIRAbstractResource):
+    """ A resource containing other resources.
+    """
+    resource_name = "Holder"
+
+    def __init__(self, jsondict=None, cast=False):
+        self.contained = None
+        super(Holder, self).__init__(jsondict, cast)
+
+    @staticmethod
+    def _declared_properties():
+        return [
+            ("contained", "contained", fhirabstractresource.FHIRAbstractResource, True, None, False),
+        ]
+
+
+class Other(fhirabstractresource.FHIRAbstractResource):
+    """ A resource to be contained.
+    """
+    resource_name = "Other"
+
+    def __init__(self, jsondict=None, cast=False):
+        self.part = None
+        super(Other, self).__init__(jsondict, cast)
+
+    @staticmethod
+    def _declared_properties():
+        return [
+            ("part", "part", Part, False, None, False),
+        ]
+
+
+HOLDER = {
+    "resourceType": "Holder",
+    "contained": [{"resourceType": "Other", "part": {"text": "o"}}],
+}
+
+
+class Choice(fhirabstractbase.FHIRAbstractBase):
+    """ A generated-style class with list, element and choice properties.
+    """
+
+    def __init__(self, jsondict=None, cast=False):
+        self.name = None
+        self.items = None
+        self.flag = None
+        self.part = None
+        self.valueString = None
+        self.valueInteger = None
+        super(Choice, self).__init__(jsondict, cast)
+
+    @staticmethod
+    def _declared_properties():
+        return [
+            ("name", "name", str, False, None, False),
+            ("items", "items", int, True, None, False),
+            ("flag", "flag", bool, False, None, False),
+            ("part", "part", Part, False, None, False),
+            ("valueString", "valueString", str, False, "value", True),
+            ("valueInteger", "valueInteger", int, False, "value", True),
+        ]
+
+    def _from_json(self, jsondict, cast):
+        used = super(Choice, self)._from_json(jsondict, cast)
+        if "name" in jsondict:
+            val = jsondict["name"]
+            if isinstance(val, list):
+                raise TypeError("The field 'name' must not be a list")
+            self.name = self._cast(val, str, False) if cast else val
+            used += 1
+        if "items" in jsondict:
+            val = jsondict["items"]
+            if not isinstance(val, list):
+                raise TypeError("The field 'items' must be a list")
+            self.items = self._cast(val, int, True) if cast else val
+            used += 1
+        if "flag" in jsondict:
+            val = jsondict["flag"]
+            if isinstance(val, list):
+                raise TypeError("The field 'flag' must not be a list")
+            self.flag = self._cast(val, bool, False) if cast else val
+            used += 1
+        if "part" in jsondict:
+            val = jsondict["part"]
+            if isinstance(val, list):
+                raise TypeError("The field 'part' must not be a list")
+            self.part = Part.with_json_and_owner(val, self, cast)
+            used += 1
+        if "valueString" in jsondict:
+            val = jsondict["valueString"]
+            if isinstance(val, list):
+                raise TypeError("The field 'valueString' must not be a list")
+            self.valueString = self._cast(val, str, False) if cast else val
+            used += 1
+        if "valueInteger" in jsondict:
+            val = jsondict["valueInteger"]
+            if isinstance(val, list):
+                raise TypeError("The field 'valueInteger' must not be a list")
+            self.valueInteger = self._cast(val, int, False) if cast else val
+            used += 1
+        return used
+
+
+class GenericChoice(Choice):
+    """ Declares no properties of its own but has no `_from_json()`, so is
+    read with the generic loop.
+    """
+
+    @staticmethod
+    def _declared_properties():
+        return []
+
+
+def is_instantiated(inst, name):
+    try:
+        object.__getattribute__(inst, name)
+        return True
+    except AttributeError:
+        return False
+
+
+class FHIRAbstractBaseTests(unittest.TestCase):
+
+    def testDeclaredProperties(self):
+        self.assertEqual([("name", "name", str, False, None, True)], Thing().elementProperties())
+        table = Thing.propertyTable()
+        self.assertTrue(table.from_json)
+        self.assertTrue(table.as_json)
+
+    def testOverriddenElementProperties(self):
+        table = ExtendedThing.propertyTable()
+        self.assertEqual(frozenset(["name", "label"]), table.names)
+        self.assertFalse(table.from_json)
+        self.assertFalse(table.as_json)
+
+        inst = ExtendedThing({"name": "n", "label": "l"})
+        self.assertEqual("n", inst.name)
+        self.assertEqual("l", inst.label)
+        self.assertEqual({"name": "n", "label": "l"}, inst.as_json())
+
+    def testOverriddenElementPropertiesLazily(self):
+        inst = ExtendedThing.with_json({"name": "n", "label": "l"}, lazy=True)
+        self.assertEqual("l", inst.label)
+        self.assertEqual({"name": "n", "label": "l"}, inst.as_json())
+
+    def testOverriddenElementPropertiesSuperfluousKey(self):
+        with self.assertLogs(level='WARNING') as logs:
+            ExtendedThing({"name": "n", "label": "l", "other": 1})
+        self.assertEqual(1, len(logs.output))
+        self.assertIn("Superfluous entry 'other'", logs.output[0])
+
+    def testSlotted(self):
+        inst = SlottedThing({"name": "n"})
+        self.assertEqual("n", inst.name)
+        self.assertIsNone(inst.size)
+        self.assertFalse(hasattr(inst, '__dict__'))
+        self.assertEqual({"name": "n"}, inst.as_json())
+
+    def testSlottedSubclass(self):
+        inst = MySlottedThing({"name": "n"})
+        self.assertEqual("n", inst.name)
+        self.assertIsNone(inst.size)
+        self.assertEqual({"name": "n"}, inst.as_json())
+        inst.extra = 1          # has a `__dict__`
+        self.assertEqual({"name": "n"}, inst.as_json())
+
+
+class FHIRLazyElementTests(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = fhirabstractresource.fhirelementfactory
+        fhirabstractresource.fhirelementfactory = factory
+
+    def tearDown(self):
+        fhirabstractresource.fhirelementfactory = self.factory
+
+    def testSameJSON(self):
+        inst = Whole.with_json(copy.deepcopy(WHOLE), lazy=True)
+        self.assertIs(Whole.lazy_class(), type(inst))
+        self.assertIsInstance(inst, Whole)
+        self.assertEqual(Whole(WHOLE).as_json(), inst.as_json())
+        self.assertEqual(WHOLE, inst.as_json())
+
+    def testMaterialization(self):
+        inst = Whole.with_json(copy.deepcopy(WHOLE), lazy=True)
+        self.assertEqual("w", inst.name)
+        self.assertEqual(["a", "b"], inst.tags)
+        self.assertFalse(is_instantiated(inst, "part"))
+        self.assertFalse(is_instantiated(inst, "parts"))
+
+        part = inst.part
+        self.assertIs(Part.lazy_class(), type(part))
+        self.assertIs(inst, part._owner)
+        self.assertEqual("p", part.text)
+        self.assertTrue(is_instantiated(inst, "part"))
+        self.assertIs(part, inst.part)
+        self.assertFalse(is_instantiated(part, "part"))
+        self.assertEqual("pp", part.part.text)
+        self.assertFalse(is_instantiated(inst, "parts"))
+
+        self.assertEqual(["1", "2"], [item.text for item in inst.parts])
+        self.assertEqual([inst, inst], [item._owner for item in inst.parts])
+        self.assertEqual("2.1", inst.parts[1].part.text)
+        self.assertEqual(Whole(WHOLE).as_json(), inst.as_json())
+
+    def testAbsentAndEmpty(self):
+        inst = Whole.with_json({"name": "w", "parts": []}, lazy=True)
+        self.assertIsNone(inst.part)
+        self.assertEqual([], inst.parts)
+        self.assertEqual({"name": "w"}, inst.as_json())
+        self.assertEqual(Whole({"name": "w", "parts": []}).as_json(), inst.as_json())
+
+    def testPassThrough(self):
+        jsondict = copy.deepcopy(WHOLE)
+        inst = Whole.with_json(jsondict, lazy=True)
+        inst.part.text = "changed"
+        js = inst.as_json()
+        self.assertEqual("changed", js["part"]["text"])
+        self.assertIsNot(jsondict["part"], js["part"])
+        self.assertIs(jsondict["part"]["part"], js["part"]["part"])
+        self.assertIs(jsondict["parts"], js["parts"])
+        self.assertEqual("p", jsondict["part"]["text"])
+
+    def testAliasing(self):
+        jsondict = copy.deepcopy(WHOLE)
+        inst = Whole.with_json(jsondict, lazy=True)
+        inst.as_json()["parts"][0]["text"] = "changed"
+        self.assertEqual("changed", jsondict["parts"][0]["text"])
+        self.assertEqual("changed", inst.parts[0].text)
+
+    def testResourceDispatch(self):
+        inst = fhirabstractresource.FHIRAbstractResource.with_json(copy.deepcopy(HOLDER), lazy=True)
+        self.assertIs(Holder.lazy_class(), type(inst))
+        self.assertFalse(is_instantiated(inst, "contained"))
+
+        contained = inst.contained
+        self.assertEqual(1, len(contained))
+        self.assertIs(Other.lazy_class(), type(contained[0]))
+        self.assertIs(inst, contained[0]._owner)
+        self.assertEqual("o", contained[0].part.text)
+        self.assertEqual(Holder(HOLDER).as_json(), inst.as_json())
+        self.assertEqual(HOLDER, inst.as_json())
+
+        self.assertIsNone(fhirabstractresource.FHIRAbstractResource.with_json({"resourceType": "Unknown"}, lazy=True))
+
+    def testPickle(self):
+        inst = Whole.with_json(copy.deepcopy(WHOLE), lazy=True)
+        self.assertEqual("p", inst.part.text)
+
+        unpickled = pickle.loads(pickle.dumps(inst))
+        self.assertIs(Whole.lazy_class(), type(unpickled))
+        self.assertTrue(is_instantiated(unpickled, "part"))
+        self.assertIs(unpickled, unpickled.part._owner)
+        self.assertFalse(is_instantiated(unpickled, "parts"))
+        self.assertEqual(WHOLE, unpickled.as_json())
+        self.assertEqual("2.1", unpickled.parts[1].part.text)
+        self.assertEqual(WHOLE, unpickled.as_json())
+
+    def testCopy(self):
+        jsondict = copy.deepcopy(WHOLE)
+        inst = Whole.with_json(jsondict, lazy=True)
+
+        shallow = copy.copy(inst)
+        self.assertIs(Whole.lazy_class(), type(shallow))
+        self.assertIs(jsondict, shallow._lazy[0])
+        self.assertEqual(WHOLE, shallow.as_json())
+
+        deep = copy.deepcopy(inst)
+        self.assertIs(Whole.lazy_class(), type(deep))
+        self.assertIsNot(jsondict, deep._lazy[0])
+        self.assertEqual("1", deep.parts[0].text)
+        self.assertEqual(WHOLE, deep.as_json())
+        self.assertFalse(is_instantiated(inst, "parts"))
+
+
+class FHIRFromJSONTests(unittest.TestCase):
+    """ Reads the same JSON with a generated `_from_json()` and with the
+    generic loop, which must give the same properties and warnings.
+    """
+
+    def read(self, klass, jsondict, cast):
+        """ Returns the serialized instance, or the error, and the warnings
+        without the instance descriptions.
+        """
+        with self.assertLogs(level='DEBUG') as logs:
+            logging.getLogger().debug('reading')        # `assertLogs()` needs at least one
+            try:
+                result = klass(copy.deepcopy(jsondict), cast).as_json(warn_nonoptionals=False)
+            except TypeError as e:
+                result = str(e)
+        return result, sorted([re.sub(r'<[^>]*>', '', line) for line in logs.output[1:]])
+
+    def assertSame(self, jsondict, cast=False):
+        self.assertTrue(Choice.propertyTable().from_json)
+        self.assertFalse(GenericChoice.propertyTable().from_json)
+        generated = self.read(Choice, jsondict, cast)
+        self.assertEqual(self.read(GenericChoice, jsondict, cast), generated)
+        return generated
+
+    def testAllKeysUsed(self):
+        self.assertEqual(({"name": "n", "valueString": "v"}, []), self.assertSame({"name": "n", "valueString": "v"}))
+        self.assertSame({"resourceType": "Choice", "fhir_comments": ["c"], "items": [1, 2], "valueInteger": 1})
+
+    def testSuperfluousKeys(self):
+        js, warnings = self.assertSame({"valueInteger": 1, "other": 1})
+        self.assertEqual(1, len(warnings))
+        self.assertIn("Superfluous entry 'other'", warnings[0])
+        self.assertSame({"name": "n", "_name": {"id": "1"}, "other": 1, "_other": 2, "valueString": "v"})
+        self.assertSame({"part": {"text": "t", "extra": 1}, "valueString": "v"})
+
+    def testUnderscoreKeys(self):
+        self.assertEqual([], self.assertSame({"name": "n", "_name": {"id": "1"}, "valueString": "v"})[1])
+        self.assertEqual([], self.assertSame({"items": [1], "_items": [None], "_valueString": {}, "valueString": "v"})[1])
+        self.assertEqual(1, len(self.assertSame({"_name": {"id": "1"}, "valueString": "v"})[1]))
+
+    def testChoiceGroups(self):
+        js, warnings = self.assertSame({"name": "n"})
+        self.assertEqual(1, len(warnings))
+        self.assertIn("Non-optional property 'value'", warnings[0])
+        self.assertSame({"valueString": "v", "valueInteger": 1})
+        self.assertSame({"value": 1, "valueString": "v"})
+        self.assertSame({"value": 1})
+
+    def testListTypeErrors(self):
+        self.assertEqual("The field 'items' must be a list", self.assertSame({"items": 1})[0])
+        self.assertEqual("The field 'name' must not be a list", self.assertSame({"name": ["n"]})[0])
+        self.assertEqual("The field 'part' must not be a list", self.assertSame({"part": [{"text": "t"}]})[0])
+
+    def testCast(self):
+        js, warnings = self.assertSame({"flag": "yes", "items": ["1", 2], "valueInteger": "3", "name": 4}, cast=True)
+        self.assertEqual({"flag": True, "items": [1, 2], "valueInteger": 3, "name": "4"}, js)
+        self.assertEqual(({}, []), self.assertSame({"flag": "maybe", "valueInteger": "x"}, cast=True))
+
+
+if '__main__' == __name__:
+    unittest.main()
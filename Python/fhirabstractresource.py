@@ -10,16 +10,21 @@ from . import fhirabstractbase
 class FHIRAbstractResource(fhirabstractbase.FHIRAbstractBase):
     """ Extends the FHIRAbstractBase with server talking capabilities.
     """
+    __slots__ = ('_server', '_local_id')
+
     resource_name = 'FHIRAbstractResource'
 
     def __init__(self, jsondict=None, cast=False):
         self._server = None
         """ The server the instance was read from. """
 
+        self._local_id = None
+        """ The id the instance was read with. """
+
         super(FHIRAbstractResource, self).__init__(jsondict, cast)
 
     @classmethod
-    def _with_json_dict(cls, jsondict, cast=False):
+    def _with_json_dict(cls, jsondict, cast=False, lazy=False):
         """ Overridden to use a factory if called when "resourceType" is
         defined in the JSON but does not match the receiver's resource_name.
         """
@@ -29,11 +34,14 @@ class FHIRAbstractResource(fhirabstractbase.FHIRAbstractBase):
 
         res_type = jsondict.get('resourceType')
         if res_type and res_type != cls.resource_name:
+            if lazy:
+                klass = fhirelementfactory.FHIRElementFactory.get_class(res_type)
+                return klass._with_json_dict(jsondict, cast, lazy) if klass else None
             return fhirelementfactory.FHIRElementFactory.instantiate(res_type, jsondict)
-        return super(FHIRAbstractResource, cls)._with_json_dict(jsondict, cast)
+        return super(FHIRAbstractResource, cls)._with_json_dict(jsondict, cast, lazy)
 
-    def as_json(self):
-        js = super(FHIRAbstractResource, self).as_json()
+    def as_json(self, warn_nonoptionals=True):
+        js = super(FHIRAbstractResource, self).as_json(warn_nonoptionals)
         js['resourceType'] = self.resource_name
         return js
 
@@ -29,5 +29,5 @@ class FHIRContainedResource(object):
             self.type = jsondict.get('resourceType')
             self.json = jsondict
     
-    def as_json(self):
+    def as_json(self, warn_nonoptionals=True):
         return self.json
@@ -53,11 +53,14 @@ class FHIRDate(object):
             return cls(jsonobj, cast)
 
     @classmethod
-    def with_json_and_owner(cls, jsonobj, owner, cast=False):
-        """ Added for compatibility reasons to FHIRElement; "owner" is
-        discarded.
+    def with_json_and_owner(cls, jsonobj, owner, cast=False, lazy=False):
+        """ Added for compatibility reasons to FHIRElement; "owner" and
+        "lazy" are discarded.
         """
         return cls.with_json(jsonobj, cast)
 
-    def as_json(self):
+    def as_json(self, warn_nonoptionals=True):
+        """ "warn_nonoptionals" is accepted for compatibility with FHIRElement
+        and discarded.
+        """
         return self.date
@@ -17,6 +17,18 @@ tpl_factory_target = '{}/fhirelementfactory.py'
 write_unittests = True
 tpl_unittest_target_ptrn = '{}/{}_tests.py'     # a pattern to determine the output files for unit tests; the one placeholder will be the class name
 
+# How many processes to process profiles, parse examples and render with (overridden by `--jobs` on the command line)
+render_jobs = 1
+
+# Whether to pin the generation date in file headers to the spec's build date
+deterministic = False
+
+# Whether to only write files whose inputs changed, tracked in a manifest in the output directory
+incremental = False
+
+# Names or URLs of the only profiles to generate, along with all profiles they depend on; None for all (overridden by `--only`)
+only_profiles = None
+
 
 ##
 ##  Know what you do when changing the following settings
@@ -29,6 +41,9 @@ default_base = {
     'resource': 'FHIRAbstractResource',
 }
 resource_modules_lowercase = True                       # whether all resource paths (i.e. modules) should be lowercase
+resource_slots = False                                  # whether generated classes keep their properties in `__slots__`, using less memory per instance
+resource_from_json = False                              # whether generated classes read JSON with their own `_from_json()` instead of a generic loop
+resource_as_json = False                                # whether generated classes serialize with their own `_as_json()`, in spec order, instead of a generic loop
 tpl_resource_source = 'Python/template-resource.py'     # the template to use as source when writing resource implementations for profiles
 manual_profiles = [                                     # all these profiles should be copied to dirname(`tpl_resource_target_ptrn`): tuples of (path, module, profile-name-list)
     ('Python/fhirabstractbase.py', 'fhirabstractbase', [
@@ -55,6 +70,11 @@ tpl_searchparams_target = '{}/fhirsearchelement.py'
 
 # unit tests
 tpl_unittest_source = 'Python/template-unittest.py'
+unittest_data_driven = False                    # instead of a test module per class, write all test values to one manifest that a single test module checks
+tpl_unittest_manifest_source = 'Python/template-unittest-manifest.json'
+tpl_unittest_manifest_target = '{}/fhirunittests.json'
+tpl_unittest_runner_source = 'Python/template-unittest-runner.py'
+tpl_unittest_runner_target = '{}/fhirunittests_tests.py'
 unittest_copyfiles = []
 unittest_format_path_prepare = '{}'             # used to format `path` before appending another path element - one placeholder for `path`
 unittest_format_path_key = '{}.{}'              # used to create property paths by appending `key` to the existing `path` - two placeholders
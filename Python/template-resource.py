@@ -4,6 +4,12 @@
 #  Generated from FHIR {{ info.version }} ({{ profile.url }}) on {{ info.date }}.
 #  {{ info.year }}, SMART Health IT.
 
+{%- macro property_doc(prop) -%}
+""" {{ prop.short|wordwrap(67, wrapstring="\n        ") }}.
+        {% if prop.is_array %}List of{% else %}Type{% endif %} `{{ prop.class_name }}`{% if prop.is_array %} items{% endif %}
+        {%- if prop.reference_to_names|length > 0 %} referencing `{{ prop.reference_to_names|join(', ') }}`{% endif %}
+        {%- if prop.json_class != prop.class_name %} (represented as `{{ prop.json_class }}` in JSON){% endif %}. """
+{%- endmacro %}
 {%- set imported = {} %}
 {%- for klass in classes %}
 
@@ -21,10 +27,19 @@ class {{ klass.name }}({% if klass.superclass in imports %}{{ klass.superclass.m
     {{ klass.formal|wordwrap(width=75, wrapstring="\n    ") }}
 {%- endif %}
     """
+{%- if settings.resource_slots %}
+    
+    __slots__ = {
+    {%- for prop in klass.properties %}
+        "{{ prop.name }}": {{ property_doc(prop) }},
+    {%- endfor %}
+    }
+{%- endif %}
 {%- if klass.resource_name %}
     
     resource_name = "{{ klass.resource_name }}"
 {%- endif %}
+{%- if not settings.resource_slots %}
     
     def __init__(self, jsondict=None, cast=False):
         """ Initialize all valid properties.
@@ -32,25 +47,23 @@ class {{ klass.name }}({% if klass.superclass in imports %}{{ klass.superclass.m
     {%- for prop in klass.properties %}
         
         self.{{ prop.name }} = None
-        """ {{ prop.short|wordwrap(67, wrapstring="\n        ") }}.
-        {% if prop.is_array %}List of{% else %}Type{% endif %} `{{ prop.class_name }}`{% if prop.is_array %} items{% endif %}
-        {%- if prop.reference_to_names|length > 0 %} referencing `{{ prop.reference_to_names|join(', ') }}`{% endif %}
-        {%- if prop.json_class != prop.class_name %} (represented as `{{ prop.json_class }}` in JSON){% endif %}. """
+        {{ property_doc(prop) }}
     {%- endfor %}
         
         super({{ klass.name }}, self).__init__(jsondict, cast)
+{%- endif %}
     
 {%- if klass.properties %}
     
-    def elementProperties(self):
-        js = super({{ klass.name }}, self).elementProperties()
+    @staticmethod
+    def _declared_properties():
         {%- if 'element' == klass.module and 'Element' == klass.name %}
         {%- for imp in imports %}{% if imp.module not in imported %}
         from . import {{ imp.module }}
         {%- set _ = imported.update({imp.module: True}) %}
         {%- endif %}{% endfor %}
         {%- endif %}
-        js.extend([
+        return [
         {%- for prop in klass.properties %}
             ("{{ prop.name }}", "{{ prop.orig_name }}",
             {%- if prop.module_name %} {{ prop.module_name }}.{% else %} {% endif %}{{ prop.class_name }}, {# #}
@@ -58,9 +71,51 @@ class {{ klass.name }}({% if klass.superclass in imports %}{{ klass.superclass.m
             {%- if prop.one_of_many %} "{{ prop.one_of_many }}"{% else %} None{% endif %}, {# #}
             {{- prop.nonoptional }}),
         {%- endfor %}
-        ])
+        ]
+    
+{%- if settings.resource_from_json %}
+    
+    def _from_json(self, jsondict, cast):
+        used = super({{ klass.name }}, self)._from_json(jsondict, cast)
+    {%- for prop in klass.properties %}
+        if "{{ prop.orig_name }}" in jsondict:
+            val = jsondict["{{ prop.orig_name }}"]
+            {%- if prop.is_array %}
+            if not isinstance(val, list):
+                raise TypeError("The field '{{ prop.orig_name }}' must be a list")
+            {%- else %}
+            if isinstance(val, list):
+                raise TypeError("The field '{{ prop.orig_name }}' must not be a list")
+            {%- endif %}
+            {%- if prop.is_native %}
+            self.{{ prop.name }} = self._cast(val, {{ prop.class_name }}, {{ prop.is_array }}) if cast else val
+            {%- else %}
+            {%- if 'element' == klass.module and 'Element' == klass.name and prop.module_name %}
+            from . import {{ prop.module_name }}
+            {%- endif %}
+            self.{{ prop.name }} = {% if prop.module_name %}{{ prop.module_name }}.{% endif %}{{ prop.class_name }}.with_json_and_owner(val, self, cast)
+            {%- endif %}
+            used += 1
+    {%- endfor %}
+        return used
+    
+{%- endif %}
+{%- if settings.resource_as_json %}
+    
+    def _as_json(self, warn_nonoptionals):
+        js = {% if klass.has_superclass(settings.default_base.resource) %}{"resourceType": self.resource_name}{% else %}{}{% endif %}
+    {%- for prop in klass.inherited_spec_properties() %}
+        {%- if prop.is_array %}
+        if self.{{ prop.name }}:
+            js["{{ prop.orig_name }}"] = {% if prop.is_native %}list(self.{{ prop.name }}){% else %}[item.as_json(warn_nonoptionals) for item in self.{{ prop.name }}]{% endif %}
+        {%- else %}
+        if self.{{ prop.name }} is not None:
+            js["{{ prop.orig_name }}"] = self.{{ prop.name }}{% if not prop.is_native %}.as_json(warn_nonoptionals){% endif %}
+        {%- endif %}
+    {%- endfor %}
         return js
     
+{%- endif %}
 {%- endif %}
 {%- endfor %}
 
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Generated from FHIR {{ info.version }} on {{ info.date }}.
+#  {{ info.year }}, SMART Health IT.
+#
+#  Runs the unit tests listed in {{ manifest }}: every example is instantiated
+#  and checked, then serialized, instantiated and checked again.
+
+
+import os
+import io
+import re
+import json
+import unittest
+import importlib
+from .fhirdate import FHIRDate
+
+path_component = re.compile(r'([^.\[\]]+)|\[(\d+)\]')
+
+
+def value_at(inst, path):
+    """ Follows a path like "name[0].given[0]" from the given instance. """
+    for name, index in path_component.findall(path):
+        inst = inst[int(index)] if index else getattr(inst, name)
+    return inst
+
+
+class FHIRUnitTests(unittest.TestCase):
+    def instantiate_from(self, module, classname, filename):
+        datadir = os.environ.get('FHIR_UNITTEST_DATADIR') or ''
+        with io.open(os.path.join(datadir, filename), 'r', encoding='utf-8') as handle:
+            js = json.load(handle)
+            self.assertEqual(classname, js["resourceType"])
+        return getattr(module, classname)(js)
+    
+    def check(self, inst, checks):
+        for path, value, typename in checks:
+            if typename in ('str', 'int', 'float'):
+                self.assertEqual(value_at(inst, path), value, path)
+            elif 'bool' == typename:
+                self.assertEqual(bool(value_at(inst, path)), value, path)
+            elif 'FHIRDate' == typename:
+                self.assertEqual(value_at(inst, path).date, FHIRDate(value).date, path)
+                self.assertEqual(value_at(inst, path).as_json(), value, path)
+    
+    def run_tests(self, modulename, classname, tests):
+        module = importlib.import_module('.' + modulename, __package__)
+        for filename, checks in sorted(tests.items()):
+            with self.subTest(filename=filename):
+                inst = self.instantiate_from(module, classname, filename)
+                self.assertIsNotNone(inst, "Must have instantiated a {} instance".format(classname))
+                self.check(inst, checks)
+                
+                js = inst.as_json()
+                self.assertEqual(classname, js["resourceType"])
+                inst2 = getattr(module, classname)(js)
+                self.check(inst2, checks)
+
+
+def add_tests(manifest_path):
+    """ Adds a test method per class in the manifest to `FHIRUnitTests`. """
+    with io.open(manifest_path, 'r', encoding='utf-8') as handle:
+        manifest = json.load(handle)
+    for classname, entry in manifest.items():
+        def test(self, classname=classname, entry=entry):
+            self.run_tests(entry['module'], classname, entry['tests'])
+        setattr(FHIRUnitTests, 'test{}'.format(classname), test)
+
+add_tests(os.path.join(os.path.dirname(os.path.abspath(__file__)), '{{ manifest }}'))
+
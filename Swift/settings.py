@@ -17,6 +17,18 @@ tpl_factory_target = '{}/FHIRAbstractBase+Factory.swift'
 write_unittests = True
 tpl_unittest_target_ptrn = '{}/Tests/{}Tests.swift'  # a pattern to determine the output files for unit tests; the one placeholder will be the class name
 
+# How many processes to process profiles, parse examples and render with (overridden by `--jobs` on the command line)
+render_jobs = 1
+
+# Whether to pin the generation date in file headers to the spec's build date
+deterministic = False
+
+# Whether to only write files whose inputs changed, tracked in a manifest in the output directory
+incremental = False
+
+# Names or URLs of the only profiles to generate, along with all profiles they depend on; None for all (overridden by `--only`)
+only_profiles = None
+
 
 ##
 ##  Know what you do when changing the following settings
@@ -59,6 +71,11 @@ tpl_searchparams_target = ''
 
 # unit tests
 tpl_unittest_source = 'Swift/template-unittest.swift'
+unittest_data_driven = False                    # not available for Swift
+tpl_unittest_manifest_source = ''
+tpl_unittest_manifest_target = ''
+tpl_unittest_runner_source = ''
+tpl_unittest_runner_target = ''
 unittest_copyfiles = [
     'Swift/XCTestCase+FHIR.swift',
     'Swift/DateAndTimeTests.swift'
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Benchmark the generator phases against fixture and synthetic specs
+
+
+import io
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import importlib
+import tracemalloc
+from concurrent import futures
+
+try:
+    import resource
+except ImportError:         # not available on Windows
+    resource = None
+
+from logger import logger
+import fhirspec
+import fhirrenderer
+
+
+# where the checked-in spec fixtures and the baselines live
+fixtures_dir = os.path.join('benchmarks', 'fixtures')
+baselines_path = os.path.join('benchmarks', 'baselines.json')
+
+# the phases, in the order they run
+phases = [
+    'read_profiles',
+    'finalize',
+    'parse_unit_tests',
+    'render_resources',
+    'render_factory',
+    'render_unittests',
+]
+
+# the synthetic spec size benchmarked when none is given: (profiles, elements)
+default_synthetic = (200, 60)
+
+# the variants of generated Python models compared with `--models`, as
+# (name, settings to generate them with); the first is the reference
+model_variants = [
+    ('generic', {}),
+    ('from_json', {'resource_from_json': True}),
+    ('as_json', {'resource_as_json': True}),
+    ('both', {'resource_from_json': True, 'resource_as_json': True}),
+]
+
+# how many examples each timed run of `--models` instantiates at least
+model_instances = 2000
+
+# metric: (unit, absolute slack below which differences are noise, whether
+# it depends on the machine and is only compared with `--check-machine`)
+metrics = {
+    'wall': ('s', 0.01, True),
+    'peak_rss': ('MB', 2.0, True),
+    'peak_traced': ('MB', 0.25, False),
+    'blocks': ('', 1000, False),
+}
+
+
+def args():
+    parser = argparse.ArgumentParser(description='FHIR models generator benchmarks')
+    parser.add_argument('--ln', default='python', help='The language to generate', choices=['python', 'swift'])
+    parser.add_argument('--fixture', action='append', help='Benchmark the fixture of this name in {}; defaults to all fixtures'.format(fixtures_dir))
+    parser.add_argument('--synthetic', nargs=2, type=int, action='append', metavar=('PROFILES', 'ELEMENTS'),
+        help='Benchmark a synthetic spec with this many resource profiles of this many elements each; repeatable. Defaults to {} {}'.format(*default_synthetic))
+    parser.add_argument('--models', action='store_true', help='Instead of the generator phases, time instantiating and serializing the spec examples with each variant of generated Python models')
+    parser.add_argument('--repeat', type=int, default=3, help='How often to time each phase; the fastest run counts')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='The relative increase over the baseline that counts as a regression')
+    parser.add_argument('--check-machine', action='store_true', help='Also fail on wall time and peak RSS regressions, which are only meaningful against baselines taken on this machine')
+    parser.add_argument('--update', action='store_true', help='Store the results as new baselines instead of comparing')
+    parser.add_argument('--baselines', default=baselines_path, help='The JSON file holding the baselines')
+    return parser
+
+
+# MARK: Synthetic Specs
+
+def write_synthetic_spec(directory, num_profiles, num_elements):
+    """ Writes a spec with `num_profiles` resource profiles of `num_elements`
+    elements each, plus one example per resource, to the given directory.
+
+    The data types, Resource and DomainResource are taken from the "trimmed"
+    fixture. Elements cycle through primitives, complex types, lists,
+    choice types, references to the next profile and backbone elements with
+    children of their own.
+    """
+    base_dir = os.path.join(fixtures_dir, 'trimmed')
+    shutil.copy(os.path.join(base_dir, 'version.info'), directory)
+    shutil.copy(os.path.join(base_dir, 'profiles-types.json'), directory)
+    with io.open(os.path.join(base_dir, 'profiles-resources.json'), 'r', encoding='utf-8') as handle:
+        base_bundle = json.load(handle)
+    base_entries = [entry for entry in base_bundle['entry'] if entry['resource']['name'] in ['Resource', 'DomainResource']]
+
+    entries = list(base_entries)
+    for idx in range(num_profiles):
+        name = 'Synthetic{}'.format(idx)
+        other = 'Synthetic{}'.format((idx + 1) % num_profiles)
+        elements = [_synthetic_element(name, ['DomainResource'])]
+        example = {'resourceType': name, 'id': 'example'}
+        for num in range(num_elements):
+            kind = num % 6
+            if 0 == kind:
+                elements.append(_synthetic_element('{}.name{}'.format(name, num), ['string']))
+                example['name{}'.format(num)] = 'Name {}'.format(num)
+            elif 1 == kind:
+                elements.append(_synthetic_element('{}.flag{}'.format(name, num), ['boolean']))
+                example['flag{}'.format(num)] = 0 == num % 2
+            elif 2 == kind:
+                elements.append(_synthetic_element('{}.code{}'.format(name, num), ['CodeableConcept'], maximum='*'))
+                example['code{}'.format(num)] = [{'coding': [{'system': 'http://example.org', 'code': str(num)}], 'text': 'Code'}]
+            elif 3 == kind:
+                elements.append(_synthetic_element('{}.ref{}'.format(name, num), [{'code': 'Reference', 'profile': [_synthetic_url(other)]}]))
+            elif 4 == kind:
+                elements.append(_synthetic_element('{}.value{}[x]'.format(name, num), ['boolean', 'integer', 'dateTime']))
+                example['value{}Integer'.format(num)] = num
+            else:
+                elements.append(_synthetic_element('{}.part{}'.format(name, num), ['BackboneElement'], maximum='*'))
+                elements.append(_synthetic_element('{}.part{}.text'.format(name, num), ['string']))
+                elements.append(_synthetic_element('{}.part{}.coding'.format(name, num), ['Coding'], maximum='*'))
+                example['part{}'.format(num)] = [{'text': 'Part', 'coding': [{'code': 'a'}]}]
+
+        entries.append({'resource': {
+            'resourceType': 'StructureDefinition',
+            'id': name,
+            'url': _synthetic_url(name),
+            'name': name,
+            'kind': 'resource',
+            'base': _synthetic_url('DomainResource'),
+            'differential': {'element': elements},
+        }})
+        with io.open(os.path.join(directory, '{}-example.json'.format(name.lower())), 'w', encoding='utf-8') as handle:
+            json.dump(example, handle)
+
+    with io.open(os.path.join(directory, 'profiles-resources.json'), 'w', encoding='utf-8') as handle:
+        json.dump({'resourceType': 'Bundle', 'entry': entries}, handle)
+
+def _synthetic_url(name):
+    return 'http://hl7.org/fhir/StructureDefinition/{}'.format(name)
+
+def _synthetic_element(path, types, maximum='1'):
+    return {
+        'path': path,
+        'min': 0,
+        'max': maximum,
+        'short': 'The {}'.format(path.split('.')[-1]),
+        'definition': 'Definition of {}.'.format(path),
+        'type': [typ if isinstance(typ, dict) else {'code': typ} for typ in types],
+    }
+
+
+# MARK: Measuring
+
+def _max_rss():
+    """ The peak resident set size of this process so far, in MB.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if 'darwin' == sys.platform else peak / 1024   # bytes on macOS, KB elsewhere
+
+def run_phases(spec_dir, settings, output, measure):
+    """ Runs all generator phases on the spec in `spec_dir`, writing to
+    `output` and calling `measure(phase, func)` to perform each phase.
+    """
+    spec = fhirspec.FHIRSpec(spec_dir, settings, read=False)
+    measure('read_profiles', lambda: (spec.prepare(), spec.read_profiles()))
+    measure('finalize', spec.finalize)
+    measure('parse_unit_tests', spec.parse_unit_tests)
+
+    renderer = fhirrenderer.FHIRStructureDefinitionRenderer(spec, settings)
+    measure('render_resources', lambda: (renderer.copy_files(output), renderer.render(output)))
+    measure('render_factory', lambda: fhirrenderer.FHIRFactoryRenderer(spec, settings).render(output))
+    measure('render_unittests', lambda: fhirrenderer.FHIRUnitTestRenderer(spec, settings).render(output))
+
+def benchmark(ln, spec_dir, repeat):
+    """ Benchmarks all phases on the spec in the given directory.
+
+    Phases are timed `repeat` times, keeping the fastest run, and the peak
+    RSS is read after each. A last run traces Python allocations to find
+    how much memory each phase allocated at its peak and how many memory
+    blocks it left allocated.
+
+    Meant to run in a process of its own, since the peak RSS never shrinks.
+
+    :returns: A dict of phase: {metric: value}
+    """
+    if 'python' == ln:
+        from Python import settings
+    else:
+        from Swift import settings
+    settings.write_resources = settings.write_factory = settings.write_unittests = True
+    settings.render_jobs = 1
+    settings.deterministic = True
+    settings.incremental = False
+    logger.setLevel(logging.WARNING)
+
+    results = {phase: {} for phase in phases}
+
+    def timed(phase, func):
+        start = time.perf_counter()
+        func()
+        wall = time.perf_counter() - start
+        previous = results[phase].get('wall')
+        results[phase]['wall'] = wall if previous is None else min(previous, wall)
+        results[phase]['peak_rss'] = _max_rss()
+
+    def traced(phase, func):
+        gc.collect()
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        blocks = sys.getallocatedblocks()
+        func()
+        results[phase]['peak_traced'] = (tracemalloc.get_traced_memory()[1] - current) / (1024 * 1024)
+        results[phase]['blocks'] = sys.getallocatedblocks() - blocks
+
+    for measure in [timed] * repeat + [traced]:
+        output = tempfile.mkdtemp(prefix='fhir-benchmark-')
+        try:
+            if traced == measure:
+                tracemalloc.start()
+            run_phases(spec_dir, settings, output, measure)
+        finally:
+            tracemalloc.stop()
+            shutil.rmtree(output)
+    return results
+
+def benchmark_synthetic(ln, num_profiles, num_elements, repeat, func=benchmark):
+    spec_dir = tempfile.mkdtemp(prefix='fhir-synthetic-')
+    try:
+        write_synthetic_spec(spec_dir, num_profiles, num_elements)
+        return func(ln, spec_dir, repeat)
+    finally:
+        shutil.rmtree(spec_dir)
+
+
+# MARK: Generated Models
+
+def benchmark_model_variant(spec_dir, overrides, repeat):
+    """ Generates Python models with the given settings overrides, then
+    times instantiating all examples of the spec from their JSON and
+    serializing them again, `repeat` times, keeping the fastest run.
+
+    Meant to run in a process of its own, so models of different variants
+    and their settings do not mix.
+
+    :returns: A dict with the number of `examples` and the seconds per
+        example for `load`, `as_json` and a `lazy` round trip, reading lazily,
+        accessing `id` and serializing again
+    """
+    from Python import settings
+    settings.write_resources = settings.write_factory = True
+    settings.write_unittests = False
+    settings.render_jobs = 1
+    settings.incremental = False
+    for key, val in overrides.items():
+        setattr(settings, key, val)
+    logger.setLevel(logging.WARNING)
+
+    spec = fhirspec.FHIRSpec(spec_dir, settings)
+    examples = []
+    for name in spec.source.names('*-example*.json'):
+        with spec.source.open(name) as handle:
+            examples.append(json.load(handle))
+
+    # the models import modules on demand, so they stay on disk until done
+    root = tempfile.mkdtemp(prefix='fhir-models-')
+    try:
+        output = os.path.join(root, 'benchmarkmodels')
+        renderer = fhirrenderer.FHIRStructureDefinitionRenderer(spec, settings)
+        renderer.copy_files(output)
+        renderer.render(output)
+        fhirrenderer.FHIRFactoryRenderer(spec, settings).render(output)
+        sys.path.insert(0, root)
+        factory = importlib.import_module('benchmarkmodels.fhirelementfactory').FHIRElementFactory
+        return time_models(factory, examples, repeat)
+    finally:
+        shutil.rmtree(root)
+
+def time_models(factory, examples, repeat):
+    # models log warnings for incomplete examples, skip examples they reject
+    logging.disable(logging.WARNING)
+    usable = []
+    for example in examples:
+        try:
+            if factory.instantiate(example.get('resourceType'), example) is not None:
+                usable.append(example)
+        except Exception as e:
+            logger.warning('Skipping example of {}: {}'.format(example.get('resourceType'), e))
+    if 0 == len(usable):
+        raise Exception('There are no examples the generated models can instantiate')
+    rounds = -(-model_instances // len(usable))
+
+    results = {'examples': len(usable)}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            instances = [factory.instantiate(example['resourceType'], example) for example in usable]
+        load = (time.perf_counter() - start) / (rounds * len(usable))
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for instance in instances:
+                instance.as_json()
+        as_json = (time.perf_counter() - start) / (rounds * len(usable))
+
+        # a round trip touching a single property
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for example in usable:
+                instance = factory.get_class(example['resourceType']).with_json(example, lazy=True)
+                instance.id
+                instance.as_json()
+        lazy = (time.perf_counter() - start) / (rounds * len(usable))
+
+        results['load'] = min(results.get('load', load), load)
+        results['as_json'] = min(results.get('as_json', as_json), as_json)
+        results['lazy'] = min(results.get('lazy', lazy), lazy)
+    return results
+
+def benchmark_models(ln, spec_dir, repeat):
+    """ Benchmarks every variant of `model_variants` on the spec in the given
+    directory, each in a fresh process. Only available for Python.
+
+    :returns: A list of (variant, results) tuples
+    """
+    results = []
+    for name, overrides in model_variants:
+        with futures.ProcessPoolExecutor(1) as executor:
+            results.append((name, executor.submit(benchmark_model_variant, spec_dir, overrides, repeat).result()))
+    return results
+
+
+# MARK: Reporting
+
+def compare(name, results, baseline, tolerance, check_machine=False):
+    """ Compares results against a baseline. Machine-dependent metrics are
+    only compared if asked to.
+
+    :returns: A list of regression descriptions
+    """
+    regressions = []
+    for phase in phases:
+        for metric, (unit, slack, machine) in sorted(metrics.items()):
+            if machine and not check_machine:
+                continue
+            value = results[phase].get(metric)
+            expected = baseline.get(phase, {}).get(metric)
+            if value is None or expected is None:
+                continue
+            if value > expected * (1 + tolerance) + slack:
+                regressions.append('{} {} {}: {:.3f}{} over baseline {:.3f}{}'
+                    .format(name, phase, metric, value, unit, expected, unit))
+    return regressions
+
+def report(name, results, baseline):
+    print('{}:'.format(name))
+    print('  {:<18}{:>12}{:>12}{:>14}{:>12}'.format('phase', 'wall (s)', 'rss (MB)', 'traced (MB)', 'blocks'))
+    for phase in phases:
+        row = results[phase]
+        print('  {:<18}{:>12.3f}{:>12.1f}{:>14.2f}{:>12d}'.format(phase, row['wall'], row['peak_rss'] or 0, row['peak_traced'], row['blocks']))
+        if phase in baseline:
+            base = baseline[phase]
+            print('  {:<18}{:>12.3f}{:>12.1f}{:>14.2f}{:>12d}'.format('  baseline', base['wall'], base['peak_rss'] or 0, base['peak_traced'], base['blocks']))
+
+def report_models(name, results):
+    """ Prints the times per example and the speedups over the first
+    variant; the lazy round trip is compared to its load plus as_json.
+    """
+    print('{} ({} examples):'.format(name, results[0][1]['examples']))
+    print('  {:<18}{:>12}{:>14}{:>12}{:>10}{:>10}{:>10}'.format('variant', 'load (us)', 'as_json (us)', 'lazy (us)', 'load', 'as_json', 'lazy'))
+    reference = results[0][1]
+    for variant, row in results:
+        print('  {:<18}{:>12.1f}{:>14.1f}{:>12.1f}{:>9.2f}x{:>9.2f}x{:>9.2f}x'.format(variant, row['load'] * 1e6, row['as_json'] * 1e6, row['lazy'] * 1e6,
+            reference['load'] / row['load'], reference['as_json'] / row['as_json'], (reference['load'] + reference['as_json']) / row['lazy']))
+
+
+if '__main__' == __name__:
+    params = vars(args().parse_args())
+
+    runs = []
+    fixtures = params['fixture']
+    synthetic = params['synthetic']
+    if fixtures is None and synthetic is None:
+        fixtures = sorted(name for name in os.listdir(fixtures_dir) if os.path.isdir(os.path.join(fixtures_dir, name)))
+        synthetic = [default_synthetic]
+    if params['models']:
+        if 'python' != params['ln']:
+            args().error('--models is only available for Python')
+        for fixture in fixtures or []:
+            report_models('models/{}'.format(fixture), benchmark_models(params['ln'], os.path.join(fixtures_dir, fixture), params['repeat']))
+        for num_profiles, num_elements in synthetic or []:
+            report_models('models/synthetic-{}x{}'.format(num_profiles, num_elements),
+                benchmark_synthetic(params['ln'], num_profiles, num_elements, params['repeat'], benchmark_models))
+        sys.exit(0)
+
+    for fixture in fixtures or []:
+        runs.append(('{}/{}'.format(params['ln'], fixture), benchmark, (params['ln'], os.path.join(fixtures_dir, fixture), params['repeat'])))
+    for num_profiles, num_elements in synthetic or []:
+        runs.append(('{}/synthetic-{}x{}'.format(params['ln'], num_profiles, num_elements), benchmark_synthetic,
+            (params['ln'], num_profiles, num_elements, params['repeat'])))
+
+    baselines = {}
+    if os.path.exists(params['baselines']):
+        with io.open(params['baselines'], 'r', encoding='utf-8') as handle:
+            baselines = json.load(handle)
+
+    regressions = []
+    for name, func, func_args in runs:
+        with futures.ProcessPoolExecutor(1) as executor:        # a fresh process for a meaningful peak RSS
+            results = executor.submit(func, *func_args).result()
+        report(name, results, baselines.get(name, {}))
+        if params['update']:
+            baselines[name] = {phase: {metric: round(val, 4) if isinstance(val, float) else val for metric, val in row.items()}
+                for phase, row in results.items()}
+        elif name in baselines:
+            regressions.extend(compare(name, results, baselines[name], params['tolerance'], params['check_machine']))
+
+    if params['update']:
+        with io.open(params['baselines'], 'w', encoding='utf-8') as handle:
+            json.dump(baselines, handle, sort_keys=True, indent=2)
+            handle.write('\n')
+        logger.info('Updated baselines in {}'.format(params['baselines']))
+
+    for regression in regressions:
+        logger.error(regression)
+    if len(regressions) > 0:
+        sys.exit(1)
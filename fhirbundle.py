@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+from logger import logger
+
+
+class FHIRBundleReader(object):
+    """ Reads a JSON FHIR Bundle from a text stream one entry at a time, so
+    that only a single entry needs to be held in memory.
+
+    Top-level members other than "entry" are decoded completely and made
+    available in `meta` once they have been read.
+    """
+    chunk_size = 65536
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.meta = {}
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def entries(self, with_text=False):
+        """ Generator yielding the dictionaries found in the Bundle's "entry"
+        array, in order.
+
+        :param bool with_text: Whether to yield (entry, "json-text") tuples,
+            the text being the entry's JSON as found in the Bundle
+        """
+        self._expect('{')
+        found_entry = False
+        while not self._consume('}'):
+            if len(self.meta) > 0 or found_entry:
+                self._expect(',')
+            key = self._decode()
+            self._expect(':')
+
+            if 'entry' == key:
+                found_entry = True
+                self._expect('[')
+                first = True
+                while not self._consume(']'):
+                    if not first:
+                        self._expect(',')
+                    first = False
+                    yield self._decode(with_text)
+            else:
+                self.meta[key] = self._decode()
+                if 'resourceType' == key and 'Bundle' != self.meta[key]:
+                    raise Exception('Expecting a Bundle but got a "{}"'.format(self.meta[key]))
+
+        if 'Bundle' != self.meta.get('resourceType'):
+            raise Exception('Expecting a Bundle but there is no "resourceType"')
+        if not found_entry:
+            raise Exception('There are no entries in this Bundle')
+
+    def resources(self, resource_type=None, with_text=False):
+        """ Generator yielding the resources of all entries, optionally only
+        those of the given type.
+
+        :param bool with_text: Whether to yield (resource, "json-text")
+            tuples, the text being the JSON of the resource's entry
+        """
+        for entry in self.entries(with_text):
+            text = None
+            if with_text:
+                entry, text = entry
+            resource = entry.get('resource')
+            if resource is None:
+                logger.warning('There is no resource in this entry: {}'.format(entry))
+                continue
+            if 'resourceType' not in resource:
+                raise Exception('Resource without "resourceType" in Bundle: {}'.format(resource))
+            if resource_type is None or resource_type == resource['resourceType']:
+                yield (resource, text) if with_text else resource
+
+
+    def read_member(self, name):
+        """ Decodes top-level members of the JSON object up to the one with
+        the given name, without reading any further. Must be called before
+        anything else has been read.
+        
+        :returns: The value of the member or None if there is no such member
+        """
+        self._expect('{')
+        first = True
+        while not self._consume('}'):
+            if not first:
+                self._expect(',')
+            first = False
+            key = self._decode()
+            self._expect(':')
+            value = self._decode()
+            if name == key:
+                return value
+        return None
+
+
+    # MARK: Tokenizing
+
+    def _fill(self, min_size=0):
+        """ Reads the next chunk, at least `min_size` characters, into the
+        buffer, dropping what has already been consumed.
+
+        :returns: False if the end of the stream has been reached
+        """
+        if self._eof:
+            return False
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        chunk = self.handle.read(max(self.chunk_size, min_size))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer += chunk
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                return
+
+    def _consume(self, char):
+        self._skip_whitespace()
+        if self._pos < len(self._buffer) and char == self._buffer[self._pos]:
+            self._pos += 1
+            return True
+        return False
+
+    def _expect(self, char):
+        if not self._consume(char):
+            found = self._buffer[self._pos:self._pos+20] if self._pos < len(self._buffer) else 'end of file'
+            raise Exception('Expecting "{}" in Bundle JSON, found "{}"'.format(char, found))
+
+    def _decode(self, with_text=False):
+        """ Decodes the next JSON value. Reads more data while the value is
+        incomplete, doubling the amount read each time to keep decoding time
+        linear for large values.
+
+        :returns: The value or, with `with_text`, a (value, "json-text") tuple
+        """
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                if end < len(self._buffer) or self._eof:    # numbers might continue in the next chunk
+                    text = self._buffer[self._pos:end] if with_text else None
+                    self._pos = end
+                    return (value, text) if with_text else value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill(len(self._buffer) - self._pos)
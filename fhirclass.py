@@ -1,14 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import bisect
+
 from logger import logger
 
 
 class FHIRClass(object):
     """ An element/resource that should become its own class.
+    
+    Classes are registered with the spec of the element's profile, see
+    `FHIRSpec.known_classes`.
     """
     
-    known = {}
+    __slots__ = ['path', 'name', 'module', 'profile', 'resource_name', 'superclass', 'superclass_name', 'short',
+        'formal', 'properties', 'spec_properties', 'expanded_nonoptionals', '_property_names', '_properties_by_name',
+        '_all_properties_by_orig_name']
     
     @classmethod
     def for_element(cls, element):
@@ -16,30 +23,32 @@ class FHIRClass(object):
         Returns a tuple with the class and a bool indicating creation.
         """
         assert element.represents_class
+        known = element.profile.spec.known_classes
         class_name = element.name_if_class()
-        if class_name in cls.known:
-            return cls.known[class_name], False
+        if class_name in known:
+            return known[class_name], False
         
         klass = cls(element)
-        cls.known[class_name] = klass
+        known[class_name] = klass
         return klass, True
     
-    @classmethod
-    def with_name(cls, class_name):
-        return cls.known.get(class_name)
-    
     def __init__(self, element):
         assert element.represents_class
         self.path = element.path
         self.name = element.name_if_class()
         self.module = None
+        self.profile = element.profile
         self.resource_name = element.name_of_resource()
         self.superclass = None
         self.superclass_name = element.superclass_name
         self.short = element.definition.short
         self.formal = element.definition.formal
         self.properties = []
+        self.spec_properties = []               # the same properties, in the order of the spec's elements
         self.expanded_nonoptionals = {}
+        self._property_names = []               # sorted names, in sync with `properties`
+        self._properties_by_name = {}
+        self._all_properties_by_orig_name = None
     
     def add_property(self, prop):
         """ Add a property to the receiver.
@@ -51,16 +60,21 @@ class FHIRClass(object):
         # do we already have a property with this name?
         # if we do and it's a specific reference, make it a reference to a
         # generic resource
-        for existing in self.properties:
-            if existing.name == prop.name:
-                if 0 == len(existing.reference_to_names):
-                    logger.warning('Already have property "{}" on "{}", which is only allowed for references'.format(prop.name, self.name))
-                else:
-                    existing.reference_to_names.extend(prop.reference_to_names)
-                return
+        existing = self._properties_by_name.get(prop.name)
+        if existing is not None:
+            if 0 == len(existing.reference_to_names):
+                logger.warning('Already have property "{}" on "{}", which is only allowed for references'.format(prop.name, self.name))
+            else:
+                existing.reference_to_names.extend(prop.reference_to_names)
+            return
         
-        self.properties.append(prop)
-        self.properties = sorted(self.properties, key=lambda x: x.name)
+        # keep properties sorted by name
+        idx = bisect.bisect(self._property_names, prop.name)
+        self._property_names.insert(idx, prop.name)
+        self.properties.insert(idx, prop)
+        self.spec_properties.append(prop)
+        self._properties_by_name[prop.name] = prop
+        self._all_properties_by_orig_name = None
         
         if prop.nonoptional and prop.one_of_many is not None:
             if prop.one_of_many in self.expanded_nonoptionals:
@@ -69,12 +83,41 @@ class FHIRClass(object):
                 self.expanded_nonoptionals[prop.one_of_many] = [prop]
     
     def property_for(self, prop_name):
-        for prop in self.properties:
-            if prop.orig_name == prop_name:
-                return prop
-        if self.superclass and self != self.superclass:         # Element is its own superclass
-            return self.superclass.property_for(prop_name)
-        return None
+        return self.all_properties_by_orig_name().get(prop_name)
+    
+    def all_properties_by_orig_name(self):
+        """ A dictionary of the receiver's and all inherited properties by
+        their original name, the receiver's properties taking precedence.
+        Built on first use, which should be after finalizing the spec.
+        """
+        if self._all_properties_by_orig_name is None:
+            props = {}
+            if self.superclass and self != self.superclass:         # Element is its own superclass
+                props.update(self.superclass.all_properties_by_orig_name())
+            own = {}
+            for prop in self.properties:
+                own.setdefault(prop.orig_name, prop)
+            props.update(own)
+            self._all_properties_by_orig_name = props
+        return self._all_properties_by_orig_name
+    
+    def inherited_spec_properties(self):
+        """ The properties of all superclasses, then those of the receiver,
+        each in the order of the spec's elements.
+        """
+        if self.superclass is None or self == self.superclass:         # Element is its own superclass
+            return list(self.spec_properties)
+        return self.superclass.inherited_spec_properties() + self.spec_properties
+    
+    def has_superclass(self, name):
+        """ Whether the receiver or one of its superclasses has the given name.
+        """
+        klass = self
+        while klass is not None:
+            if name == klass.name:
+                return True
+            klass = klass.superclass if klass != klass.superclass else None
+        return False
     
     def should_write(self):
         if self.superclass is not None:
@@ -91,12 +134,31 @@ class FHIRClass(object):
     @property
     def sorted_nonoptionals(self):
         return sorted(self.expanded_nonoptionals.items())
+    
+    def signature(self):
+        """ A string over everything templates render for the class, including
+        what its superclasses contribute. Class, module and property names and
+        types come from the mappings, so the signature changes with the
+        mapping entries the class uses.
+        """
+        chain = []
+        klass = self.superclass if self != self.superclass else None
+        while klass is not None:
+            chain.append((klass.name, klass.module))
+            klass = klass.superclass if klass != klass.superclass else None
+        return repr((self.path, self.name, self.module, self.resource_name, self.superclass_name, self.short,
+            self.formal, chain, [prop.signature() for prop in self.properties],
+            [prop.signature() for prop in self.inherited_spec_properties()],
+            [(name, [prop.name for prop in props]) for name, props in self.sorted_nonoptionals]))
 
 
 class FHIRClassProperty(object):
     """ An element describing an instance property.
     """
     
+    __slots__ = ['path', 'one_of_many', 'orig_name', 'name', 'parent_name', 'class_name', 'module_name',
+        'json_class', 'is_native', 'is_array', 'nonoptional', 'reference_to_names', 'short', 'representation']
+    
     def __init__(self, element, type_obj, type_name=None):
         assert element and type_obj     # and must be instances of FHIRStructureDefinitionElement and FHIRElementType
         spec = element.profile.spec
@@ -123,3 +185,6 @@ class FHIRClassProperty(object):
         self.short = element.definition.short
         self.representation = element.definition.representation
 
+    
+    def signature(self):
+        return repr(tuple([getattr(self, name) for name in self.__class__.__slots__]))
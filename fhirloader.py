@@ -2,87 +2,467 @@
 # -*- coding: utf-8 -*-
 
 import io
+import re
+import json
 import os.path
+import contextlib
+from concurrent import futures
 from logger import logger
 
 
+@contextlib.contextmanager
+def _locked(path):
+    """ Holds an exclusive lock on the given lock file, where supported.
+    """
+    try:
+        import fcntl
+    except ImportError:         # not available on Windows
+        yield
+        return
+    with io.open(path, 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
 class FHIRLoader(object):
     """ Class to download the files needed for the generator.
     
     The `needs` dictionary contains as key the local file needed and how to
     get it from the specification URL.
+    
+    Downloads are kept in a content-addressed store in the cache directory,
+    so several spec versions can be cached side by side and identical files
+    are only stored once:
+    
+    - `objects/` holds every downloaded file, named by its content hash
+    - `versions/<name>/` holds the files of one spec URL, linked to objects
+    - `index.json` maps spec URLs to the objects of their files, with size
+      and modification time to check freshness without reading them
+    
+    Spec files directly in the cache directory, from caches written before
+    versions were stored separately or from a manual download, are moved to
+    the version directory of their spec URL.
     """
     needs = {
         'version.info': 'version.info',
         'profiles-resources.json': 'validation-min.json.zip',
         'allergyintolerance-example.json': 'examples-json.zip',
     }
+    chunk_size = 1024 * 1024
     
     def __init__(self, settings, cache):
         self.settings = settings
         self.base_url = settings.specification_url
         self.cache = cache
+        self.directory = os.path.join(cache, 'versions', self.version_name(self.base_url))
+        self.uses_flat = False
+    
+    @classmethod
+    def version_name(cls, spec_url):
+        """ The name of the version directory for the spec at the given URL.
+        """
+        return re.sub(r'[^\w.-]+', '_', spec_url.split('://')[-1].strip('/'))
+    
+    @property
+    def index_path(self):
+        return os.path.join(self.cache, 'index.json')
+    
+    def has_flat_files(self):
+        """ Whether the cache directory itself holds spec files, as the cache
+        did before versions were stored separately or after a manual
+        download. These may be of any spec URL.
+        """
+        return os.path.exists(os.path.join(self.cache, 'version.info'))
     
     def load(self, force=False):
         """ Makes sure all the files needed have been downloaded.
         
-        :returns: The path to the directory with all our files.
-        """
-        if os.path.isdir(self.cache) and force:
-            import shutil
-            shutil.rmtree(self.cache)
+        Missing archives are downloaded concurrently. Archives are not
+        extracted, their members are read directly; see `extract_to()` for
+        the example files generated unit tests read. Loaders for the same spec
+        URL, also in other processes, wait for each other.
         
-        if not os.path.isdir(self.cache):
-            os.mkdir(self.cache)
+        Spec files directly in the cache directory are moved to our version
+        directory if they are of our spec URL, see `adopt_flat_files()`.
+        
+        :returns: A FHIRSpecSource for the directory with all our files.
+        """
+        self.uses_flat = False
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
         
-        # check all files and download if missing
-        uses_cache = False
-        for local, remote in self.__class__.needs.items():
-            path = os.path.join(self.cache, local)
+        with _locked(self.directory + '.lock'):
+            if force:
+                self.remove_version()
             
-            if not os.path.exists(path):
-                logger.info('Downloading {}'.format(remote))
-                filename = self.download(remote)
-                
-                # unzip
-                if '.zip' == filename[-4:]:
-                    logger.info('Extracting {}'.format(filename))
-                    self.expand(filename)
+            entries = self.read_index().get(self.base_url, {})
+            if self.has_flat_files() and not force and not self.is_cached('version.info', 'version.info', entries):
+                if not self.adopt_flat_files():
+                    self.uses_flat = True
+                    return self.source_in(self.cache)
+                entries = self.read_index().get(self.base_url, {})
+            
+            # check all files and download if missing
+            uses_cache = False
+            missing = []
+            for local, remote in self.__class__.needs.items():
+                if self.is_cached(local, remote, entries):
+                    uses_cache = True
+                elif remote not in missing:
+                    missing.append(remote)
+            
+            if len(missing) > 0:
+                with futures.ThreadPoolExecutor(len(missing)) as executor:
+                    list(executor.map(self.download, missing))
+            
+            if uses_cache:
+                logger.info('Using cached resources of {}, supply "-f" to re-download'.format(self.base_url))
+        
+        return self.source_in(self.directory)
+    
+    def adopt_flat_files(self):
+        """ Moves the spec files directly in the cache directory to our
+        version directory, archives into the object store, if they are of our
+        spec URL. That is the case if they have the same "version.info" as
+        our spec URL, which is downloaded to tell.
+        
+        :returns: False if our "version.info" cannot be downloaded, e.g. when
+            offline; the files in the cache directory are then used as they
+            are
+        """
+        import fhirmanifest
+        flat_info = os.path.join(self.cache, 'version.info')
+        try:
+            self.download('version.info')
+        except Exception as e:
+            logger.warning('Cannot download version.info of {} ({}), using the spec files in {}, which may be of another version'
+                .format(self.base_url, e, self.cache))
+            return False
+        
+        if fhirmanifest.hash_of_file(flat_info) != fhirmanifest.hash_of_file(os.path.join(self.directory, 'version.info')):
+            logger.info('The spec files in {} are not of {}, not using them'.format(self.cache, self.base_url))
+            return True
+        
+        logger.info('Moving the spec files of {} in {} to {}'.format(self.base_url, self.cache, self.directory))
+        archives = set(self.__class__.needs.values())
+        entries = {}
+        for name in sorted(os.listdir(self.cache)):
+            path = os.path.join(self.cache, name)
+            if not os.path.isfile(path) or name in ('version.info', 'index.json') or name.endswith(('.lock', '.tmp')):
+                continue
+            if name in archives:
+                entries[name] = self.store(path, name)
             else:
-                uses_cache = True
+                os.replace(path, os.path.join(self.directory, name))
+        os.remove(flat_info)
+        self.update_index(entries)
+        return True
+    
+    @property
+    def examples_directory(self):
+        """ The directory example files read by generated unit tests are
+        extracted to, to be used as FHIR_UNITTEST_DATADIR.
+        """
+        return self.cache if self.uses_flat else os.path.join(self.directory, 'examples')
+    
+    @property
+    def snapshot_directory(self):
+        """ The directory to keep snapshots of the parsed spec in. Spec files
+        used from the cache directory may be of another version, their
+        snapshots are kept apart.
+        """
+        return os.path.join(self.cache, 'snapshots', 'flat' if self.uses_flat else self.version_name(self.base_url))
+    
+    def source_in(self, directory):
+        archives = sorted(set([remote for remote in self.__class__.needs.values() if '.zip' == remote[-4:]]))
+        archives = [archive for archive in archives if os.path.exists(os.path.join(directory, archive))]
+        return FHIRSpecSource(directory, archives)
+    
+    def is_cached(self, local, remote, entries):
+        """ A local file counts as cached if the file it comes from is in the
+        index and unchanged since, or if it exists as a file of its own (for
+        example when downloaded manually).
+        """
+        entry = entries.get(remote)
+        path = os.path.join(self.directory, remote)
+        if entry is not None and os.path.exists(path):
+            stat = os.stat(path)
+            if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime']:
+                return True
+            logger.warning('File {} has changed, downloading again'.format(remote))
+            os.remove(path)
+        return os.path.exists(os.path.join(self.directory, local))
+    
+    
+    # MARK: Store
+    
+    def read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with io.open(self.index_path, 'r', encoding='utf-8') as handle:
+            return json.load(handle)
+    
+    def _write_index(self, index):
+        tmp_path = '{}.{}.tmp'.format(self.index_path, os.getpid())
+        with io.open(tmp_path, 'w', encoding='utf-8') as handle:
+            json.dump(index, handle, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+    
+    def update_index(self, entries):
+        """ Adds or replaces the given file entries of our spec URL, leaving
+        other URLs' entries, possibly just written by other processes, alone.
+        """
+        with _locked(self.index_path + '.lock'):
+            index = self.read_index()
+            index.setdefault(self.base_url, {}).update(entries)
+            self._write_index(index)
+    
+    def remove_version(self):
+        """ Removes the files of our spec URL and the objects no other spec
+        URL uses.
+        """
+        import shutil
+        with _locked(self.index_path + '.lock'):
+            index = self.read_index()
+            removed = index.pop(self.base_url, {})
+            used = set(entry['object'] for entries in index.values() for entry in entries.values())
+            for entry in removed.values():
+                path = os.path.join(self.cache, 'objects', entry['object'])
+                if entry['object'] not in used and os.path.exists(path):
+                    os.remove(path)
+            self._write_index(index)
+        shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+    
+    def is_shared(self, digest):
+        """ Whether the object with the given digest is used by another spec
+        URL.
+        """
+        return any(entry['object'] == digest
+            for url, entries in self.read_index().items() if url != self.base_url
+            for entry in entries.values())
+    
+    def store(self, path, filename):
+        """ Moves a downloaded file into the object store, unless an identical
+        one is already there, and links it into our version directory.
+        
+        An object whose content no longer matches its name, e.g. because a
+        linked file was changed in place, is replaced by the download.
+        
+        :returns: The index entry for the file
+        """
+        import fhirmanifest
+        digest = fhirmanifest.hash_of_file(path)
+        objects = os.path.join(self.cache, 'objects')
+        if not os.path.isdir(objects):
+            os.makedirs(objects, exist_ok=True)
+        
+        object_path = os.path.join(objects, digest)
+        if os.path.exists(object_path) and fhirmanifest.hash_of_file(object_path) == digest:
+            if self.is_shared(digest):
+                logger.info('Already have {} from another version, not storing it again'.format(filename))
+            os.remove(path)
+        else:
+            os.replace(path, object_path)
         
-        if uses_cache:
-            logger.info('Using cached resources, supply "-f" to re-download')
+        target = os.path.join(self.directory, filename)
+        tmp_path = target + '.link'
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(object_path, tmp_path)
+        except OSError:         # no hard links on this file system
+            try:
+                os.symlink(os.path.abspath(object_path), tmp_path)
+            except OSError:
+                import shutil
+                shutil.copy2(object_path, tmp_path)
+        os.replace(tmp_path, target)
         
-        return self.cache
+        stat = os.stat(target)
+        return {'object': digest, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
     
     def download(self, filename):
         """ Download the given file located on the server.
         
-        :returns: The local file name in our cache directory the file was
-            downloaded to
+        Data is written to a ".part" file first, which is resumed with an HTTP
+        Range request if it exists from an earlier, interrupted download. The
+        file is only moved into place once it has been verified.
+        
+        :returns: The index entry of the stored file
         """
         import requests     # import here as we can bypass its use with a manual download
         
         url = self.base_url+'/'+filename
-        path = os.path.join(self.cache, filename)
+        part_path = os.path.join(self.directory, filename + '.part')
         
-        ret = requests.get(url)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset > 0 else {}
+        ret = requests.get(url, headers=headers, stream=True)
+        if 416 == ret.status_code:          # range not satisfiable, start over
+            ret.close()
+            offset = 0
+            ret = requests.get(url, stream=True)
         if not ret.ok:
             raise Exception("Failed to download {}".format(url))
-        with io.open(path, 'wb') as handle:
-            for chunk in ret.iter_content():
+        
+        if 206 == ret.status_code:
+            logger.info('Resuming download of {} at {} bytes'.format(filename, offset))
+        else:
+            offset = 0
+        
+        with ret, io.open(part_path, 'ab' if offset > 0 else 'wb') as handle:
+            for chunk in ret.iter_content(chunk_size=self.__class__.chunk_size):
                 handle.write(chunk)
         
-        return filename
+        # the advertised length only matches the written data if the content is not encoded
+        length = ret.headers.get('Content-Length')
+        if length is not None and 'Content-Encoding' not in ret.headers:
+            if os.path.getsize(part_path) != offset + int(length):
+                raise Exception("Download of {} is incomplete, run again to resume".format(url))
+        
+        self.verify(part_path, filename)
+        entry = self.store(part_path, filename)
+        self.update_index({filename: entry})        # right away, in case other downloads fail
+        return entry
     
-    def expand(self, local):
-        """ Expand the ZIP file at the given path to the cache directory.
+    def verify(self, path, filename):
+        """ Make sure a downloaded archive is intact, removing it if not.
         """
-        path = os.path.join(self.cache, local)
-        assert os.path.exists(path)
-        import zipfile      # import here as we can bypass its use with a manual unzip
+        if '.zip' != filename[-4:]:
+            return
+        import zipfile
         
-        with zipfile.ZipFile(path) as z:
-            z.extractall(self.cache)
+        damaged = None
+        try:
+            with zipfile.ZipFile(path) as z:
+                damaged = z.testzip()
+        except zipfile.BadZipfile as e:
+            damaged = str(e)
+        if damaged is not None:
+            os.remove(path)
+            raise Exception("Downloaded archive {} is damaged ({})".format(filename, damaged))
+
 
+class FHIRSpecSource(object):
+    """ Gives access to the files of a FHIR spec by name, wherever they are:
+    as files in the spec directory or as members of zip archives in it.
+    Files in the directory take precedence over archive members.
+    
+    The index of all names is built once; archives are opened once per
+    process and read without extracting them.
+    """
+    
+    def __init__(self, directory, archives=None):
+        assert os.path.isdir(directory)
+        self.directory = directory
+        self.archives = archives or []
+        self._index = None          # name: (archive-path or None, member-name)
+        self._zipfiles = {}
+        self._pid = None
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_zipfiles'] = {}
+        return state
+    
+    @property
+    def index(self):
+        if self._index is None:
+            index = {}
+            for archive in self.archives:
+                path = os.path.join(self.directory, archive)
+                for member in self._zipfile(path).namelist():
+                    name = os.path.basename(member)
+                    if name and name not in index:
+                        index[name] = (path, member)
+            for name in os.listdir(self.directory):
+                if os.path.isfile(os.path.join(self.directory, name)):
+                    index[name] = (None, name)
+            self._index = index
+        return self._index
+    
+    def _zipfile(self, path):
+        """ Returns the open archive at the given path. Processes forked from
+        us open their own, as they would otherwise share file positions.
+        """
+        import zipfile
+        if self._pid != os.getpid():
+            self._zipfiles = {}
+            self._pid = os.getpid()
+        if path not in self._zipfiles:
+            self._zipfiles[path] = zipfile.ZipFile(path)
+        return self._zipfiles[path]
+    
+    def names(self, pattern='*'):
+        """ Returns the sorted names of all files matching the pattern.
+        """
+        import fnmatch
+        return sorted(fnmatch.filter(self.index.keys(), pattern))
+    
+    def exists(self, name):
+        return name in self.index
+    
+    def path_of(self, name):
+        """ A path for the file with the given name, for display purposes.
+        """
+        archive, member = self.index[name]
+        return os.path.join(archive, member) if archive is not None else os.path.join(self.directory, name)
+    
+    def open(self, name):
+        """ Opens the file with the given name for reading UTF-8 text.
+        """
+        if name not in self.index:
+            raise Exception('There is no file "{}" in the spec at {}'.format(name, self.directory))
+        archive, member = self.index[name]
+        if archive is None:
+            return io.open(os.path.join(self.directory, name), 'r', encoding='utf-8')
+        return io.TextIOWrapper(self._zipfile(archive).open(member), encoding='utf-8')
+    
+    def extract_to(self, directory, names):
+        """ Extracts the named archive members into the given directory,
+        skipping files that are already there with the member's size.
+        
+        :returns: The number of files extracted
+        """
+        import shutil
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        
+        count = 0
+        for name in sorted(names):
+            archive, member = self.index[name]
+            target = os.path.join(directory, name)
+            if archive is None:
+                if os.path.abspath(os.path.dirname(target)) == os.path.abspath(self.directory):
+                    continue
+                src = io.open(os.path.join(self.directory, name), 'rb')
+            else:
+                if os.path.exists(target) and os.path.getsize(target) == self._zipfile(archive).getinfo(member).file_size:
+                    continue
+                src = self._zipfile(archive).open(member)
+            tmp_path = '{}.{}.tmp'.format(target, os.getpid())
+            with src, io.open(tmp_path, 'wb') as handle:
+                shutil.copyfileobj(src, handle)
+            os.replace(tmp_path, target)
+            count += 1
+        return count
+    
+    def fingerprint(self, name):
+        """ A string that changes whenever the content of the named file
+        changes; archive members are fingerprinted by their CRC and size
+        without decompressing them.
+        """
+        archive, member = self.index[name]
+        if archive is None:
+            import hashlib
+            sha = hashlib.sha1()
+            with io.open(os.path.join(self.directory, name), 'rb') as handle:
+                for chunk in iter(lambda: handle.read(65536), b''):
+                    sha.update(chunk)
+            return '{}:{}'.format(name, sha.hexdigest())
+        info = self._zipfile(archive).getinfo(member)
+        return '{}/{}:{}:{}'.format(os.path.basename(archive), member, info.CRC, info.file_size)
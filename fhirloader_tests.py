@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import zipfile
+import tempfile
+import threading
+import unittest
+from http import server
+
+import fhirloader
+import fhirmanifest
+
+
+def _zip(name, content):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as z:
+        z.writestr(name, content)
+    return data.getvalue()
+
+
+class SpecHandler(server.BaseHTTPRequestHandler):
+    """ Serves the same spec files below any path, honoring Range requests.
+    """
+    files = {
+        'version.info': b'[FHIR]\nFhirVersion=1.0.2\n',
+        'validation-min.json.zip': _zip('profiles-resources.json', '{"resourceType": "Bundle", "entry": []}' * 100),
+        'examples-json.zip': _zip('allergyintolerance-example.json', '{"resourceType": "AllergyIntolerance"}' * 100),
+    }
+    ranges = []
+    paths = []
+
+    def do_GET(self):
+        self.__class__.paths.append(self.path)
+        data = self.files.get(self.path.split('/')[-1])
+        if data is None:
+            self.send_error(404)
+            return
+
+        offset = 0
+        rng = self.headers.get('Range')
+        if rng is not None:
+            self.__class__.ranges.append(rng)
+            offset = int(rng[len('bytes='):].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(offset, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - offset))
+        self.end_headers()
+        self.wfile.write(data[offset:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Settings(object):
+    def __init__(self, specification_url):
+        self.specification_url = specification_url
+
+
+class FHIRLoaderTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = server.HTTPServer(('127.0.0.1', 0), SpecHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.base_url = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.cache = tempfile.mkdtemp()
+        SpecHandler.ranges = []
+        SpecHandler.paths = []
+
+    def tearDown(self):
+        shutil.rmtree(self.cache)
+
+    def loader(self, path='spec'):
+        return fhirloader.FHIRLoader(Settings('{}/{}'.format(self.base_url, path)), self.cache)
+
+    def assertStored(self, loader, filename):
+        path = os.path.join(loader.directory, filename)
+        with io.open(path, 'rb') as handle:
+            self.assertEqual(SpecHandler.files[filename], handle.read())
+        entry = loader.read_index()[loader.base_url][filename]
+        object_path = os.path.join(self.cache, 'objects', entry['object'])
+        self.assertEqual(entry['object'], fhirmanifest.hash_of_file(object_path))
+        self.assertEqual(os.path.getsize(path), entry['size'])
+
+    def testLoad(self):
+        loader = self.loader()
+        source = loader.load()
+        for filename in SpecHandler.files:
+            self.assertStored(loader, filename)
+        self.assertTrue(source.exists('profiles-resources.json'))
+        self.assertTrue(source.exists('allergyintolerance-example.json'))
+        self.assertEqual([], SpecHandler.ranges)
+
+    def testResume(self):
+        loader = self.loader()
+        os.makedirs(loader.directory)
+        data = SpecHandler.files['examples-json.zip']
+        with io.open(os.path.join(loader.directory, 'examples-json.zip.part'), 'wb') as handle:
+            handle.write(data[:len(data) // 2])
+
+        with self.assertLogs('fhirparser', level='INFO') as logs:
+            loader.load()
+        self.assertEqual(['bytes={}-'.format(len(data) // 2)], SpecHandler.ranges)
+        self.assertTrue(any('Resuming download of examples-json.zip' in line for line in logs.output))
+        self.assertStored(loader, 'examples-json.zip')
+        self.assertFalse(os.path.exists(os.path.join(loader.directory, 'examples-json.zip.part')))
+
+    def testDeduplicate(self):
+        first = self.loader('first')
+        first.load()
+        with self.assertLogs('fhirparser', level='INFO') as logs:
+            second = self.loader('second')
+            second.load()
+        self.assertEqual(len(SpecHandler.files), len(os.listdir(os.path.join(self.cache, 'objects'))))
+        self.assertEqual(first.read_index()[first.base_url], second.read_index()[second.base_url])
+        self.assertTrue(any('from another version' in line for line in logs.output))
+        for filename in SpecHandler.files:
+            self.assertStored(second, filename)
+
+    def testRepairCorrupted(self):
+        loader = self.loader()
+        loader.load()
+
+        # change the linked file in place, which may also change its object
+        path = os.path.join(loader.directory, 'examples-json.zip')
+        with io.open(path, 'r+b') as handle:
+            handle.seek(10)
+            handle.write(b'corrupted')
+            handle.write(b'!' * 100)
+
+        with self.assertLogs('fhirparser', level='INFO') as logs:
+            loader.load()
+        self.assertTrue(any('has changed' in line for line in logs.output))
+        self.assertFalse(any('from another version' in line for line in logs.output))
+        self.assertStored(loader, 'examples-json.zip')
+
+        # the repaired download is used as it is by the next run
+        with self.assertLogs('fhirparser', level='INFO') as logs:
+            loader.load()
+        self.assertFalse(any('has changed' in line for line in logs.output))
+        self.assertStored(loader, 'examples-json.zip')
+
+    def testExtractExamples(self):
+        loader = self.loader()
+        source = loader.load()
+        names = ['allergyintolerance-example.json']
+        self.assertEqual(1, source.extract_to(loader.examples_directory, names))
+        with io.open(os.path.join(loader.examples_directory, names[0]), 'rb') as handle:
+            self.assertEqual(b'{"resourceType": "AllergyIntolerance"}' * 100, handle.read())
+        self.assertEqual(0, source.extract_to(loader.examples_directory, names))
+
+    def writeFlatFiles(self, version_info):
+        with io.open(os.path.join(self.cache, 'version.info'), 'wb') as handle:
+            handle.write(version_info)
+        with io.open(os.path.join(self.cache, 'examples-json.zip'), 'wb') as handle:
+            handle.write(SpecHandler.files['examples-json.zip'])
+        with io.open(os.path.join(self.cache, 'profiles-resources.json'), 'w', encoding='utf-8') as handle:
+            handle.write('{"resourceType": "Bundle", "entry": []}')
+
+    def testFlatCacheOfOtherVersion(self):
+        self.writeFlatFiles(b'[FHIR]\nFhirVersion=3.0.1\n')
+        loader = self.loader()
+        with self.assertLogs('fhirparser', level='INFO') as logs:
+            source = loader.load()
+        self.assertTrue(any('are not of' in line for line in logs.output))
+        self.assertEqual(loader.directory, source.directory)
+        for filename in SpecHandler.files:
+            self.assertStored(loader, filename)
+        self.assertTrue(os.path.exists(os.path.join(self.cache, 'version.info')))
+        self.assertTrue(os.path.exists(os.path.join(self.cache, 'profiles-resources.json')))
+        self.assertFalse(loader.uses_flat)
+
+    def testFlatCacheOfSameVersion(self):
+        self.writeFlatFiles(SpecHandler.files['version.info'])
+        loader = self.loader()
+        source = loader.load()
+        self.assertEqual(loader.directory, source.directory)
+        self.assertEqual(['/spec/version.info'], SpecHandler.paths)
+        self.assertStored(loader, 'examples-json.zip')
+        self.assertTrue(os.path.exists(os.path.join(loader.directory, 'profiles-resources.json')))
+        self.assertFalse(os.path.exists(os.path.join(self.cache, 'version.info')))
+        self.assertFalse(os.path.exists(os.path.join(self.cache, 'examples-json.zip')))
+
+        # the moved files are used by the next run
+        SpecHandler.paths = []
+        loader.load()
+        self.assertEqual([], SpecHandler.paths)
+
+    def testFlatCacheOffline(self):
+        self.writeFlatFiles(b'[FHIR]\nFhirVersion=3.0.1\n')
+        loader = fhirloader.FHIRLoader(Settings('http://127.0.0.1:1/spec'), self.cache)
+        with self.assertLogs('fhirparser', level='WARNING') as logs:
+            source = loader.load()
+        self.assertTrue(any('may be of another version' in line for line in logs.output))
+        self.assertEqual(self.cache, source.directory)
+        self.assertTrue(loader.uses_flat)
+        self.assertTrue(loader.snapshot_directory.endswith('flat'))
+
+
+if '__main__' == __name__:
+    unittest.main()
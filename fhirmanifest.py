@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import json
+import hashlib
+
+from logger import logger
+
+# settings that have no influence on the content of generated files
+settings_not_affecting_output = [
+    'render_jobs',
+    'incremental',
+    'deterministic',
+    'write_resources',
+    'write_factory',
+    'write_unittests',
+]
+
+# mappings whose entries only reach generated files through the classes that
+# use them, which renderers depend on via `FHIRClass.signature()`
+settings_reflected_in_classes = [
+    'classmap',
+    'replacemap',
+    'starexpandtypes',
+    'natives',
+    'jsonmap',
+    'jsonmap_default',
+    'reservedmap',
+]
+
+
+def hash_of(*items):
+    """ Returns a hex digest over all the given strings; None is treated like
+    an empty string.
+    """
+    sha = hashlib.sha1()
+    for item in items:
+        if item is not None:
+            sha.update(item.encode('utf-8') if not isinstance(item, bytes) else item)
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def hash_of_file(filepath):
+    sha = hashlib.sha1()
+    with io.open(filepath, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(65536), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_of_settings(settings, skip=()):
+    """ Returns a hex digest over all setting values that influence generated
+    file content, leaving out the names in `skip`.
+    """
+    values = {}
+    for key, val in vars(settings).items():
+        if not key.startswith('_') and key not in settings_not_affecting_output and key not in skip \
+            and not hasattr(val, '__dict__'):        # skip imported modules
+            values[key] = val
+    return hash_of(json.dumps(values, sort_keys=True, default=sorted))
+
+
+def write_if_changed(filepath, chunks):
+    """ Streams the given byte chunks into `filepath`, unless the file already
+    has exactly this content.
+
+    An existing file is compared with the chunks as they come in; only once
+    they differ is a temporary file next to `filepath` written, starting
+    with the part that matched, which then replaces the file.
+
+    :returns: A tuple of a bool telling whether the file was written and the
+        hash of the content
+    """
+    dirpath = os.path.dirname(filepath)
+    if dirpath and not os.path.isdir(dirpath):
+        os.makedirs(dirpath)
+
+    sha = hashlib.sha1()
+    chunks = iter(chunks)
+    matched = 0
+    differing = None
+    if os.path.exists(filepath):
+        with io.open(filepath, 'rb') as existing:
+            for chunk in chunks:
+                sha.update(chunk)
+                if existing.read(len(chunk)) != chunk:
+                    differing = chunk
+                    break
+                matched += len(chunk)
+            else:
+                if not existing.read(1):
+                    return False, sha.hexdigest()
+
+    tmp_path = filepath + '.tmp'
+    with io.open(tmp_path, 'wb') as handle:
+        if matched > 0:
+            with io.open(filepath, 'rb') as existing:
+                while matched > 0:
+                    chunk = existing.read(min(matched, 65536))
+                    handle.write(chunk)
+                    matched -= len(chunk)
+        if differing is not None:
+            handle.write(differing)
+        for chunk in chunks:
+            sha.update(chunk)
+            handle.write(chunk)
+    os.replace(tmp_path, filepath)
+    return True, sha.hexdigest()
+
+
+class FHIRManifest(object):
+    """ Keeps track of all files written to an output directory.
+
+    For every file the manifest stores a hash of the inputs the file was
+    generated from and a hash of its content. This allows to skip renders
+    whose inputs did not change, to leave files untouched whose content did
+    not change and to remove files that are no longer being generated.
+    Entries are grouped by the renderer that produced them, only groups active
+    during a run can produce stale files.
+    """
+    filename = '.fhir-parser-manifest.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.filepath = os.path.join(directory, self.__class__.filename)
+        self.previous = {}
+        self.entries = {}
+        self.active_groups = set()
+        self._template_hashes = {}
+
+        if os.path.exists(self.filepath):
+            with io.open(self.filepath, 'r', encoding='utf-8') as handle:
+                self.previous = json.load(handle)
+
+    def activate(self, group):
+        self.active_groups.add(group)
+
+    def key_for(self, target_path):
+        return os.path.relpath(target_path, self.directory)
+
+    def template_hash(self, template_path):
+        if template_path not in self._template_hashes:
+            self._template_hashes[template_path] = hash_of_file(template_path)
+        return self._template_hashes[template_path]
+
+    def is_current(self, target_path, inputs_hash):
+        """ Checks whether the file at the target path has been generated from
+        the same inputs and still has the content we wrote; if so, keeps its
+        entry for the new manifest.
+        """
+        key = self.key_for(target_path)
+        entry = self.previous.get(key)
+        if entry is None or entry['inputs'] != inputs_hash:
+            return False
+        if not os.path.exists(target_path) or hash_of_file(target_path) != entry['content']:
+            return False
+
+        self.entries[key] = entry
+        return True
+
+    def record(self, target_path, inputs_hash, content_hash, group):
+        self.entries[self.key_for(target_path)] = {
+            'inputs': inputs_hash,
+            'content': content_hash,
+            'group': group,
+        }
+
+    def copy_file(self, source_path, target_path, group):
+        """ Copies a file, unless the target already has the same content.
+        """
+        if self.is_current(target_path, hash_of_file(source_path)):
+            return
+        with io.open(source_path, 'rb') as handle:
+            did_write, content_hash = write_if_changed(target_path, iter(lambda: handle.read(65536), b''))
+        if did_write:
+            logger.info('Copying %s to %s', os.path.basename(source_path), target_path)
+        self.record(target_path, content_hash, content_hash, group)
+
+    def finish(self):
+        """ Removes stale files and writes the manifest, if it changed.
+        """
+        for key, entry in self.previous.items():
+            if key in self.entries:
+                continue
+            if entry.get('group') not in self.active_groups:
+                self.entries[key] = entry
+                continue
+
+            path = os.path.join(self.directory, key)
+            if os.path.exists(path):
+                logger.info('Removing stale %s', path)
+                os.remove(path)
+
+        if self.entries != self.previous:
+            content = json.dumps(self.entries, sort_keys=True, indent=2)
+            write_if_changed(self.filepath, [content.encode('utf-8')])
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+
+
+class FHIROutput(object):
+    """ Where renderers put generated and copied files.
+
+    Renderers build target paths from `directory`, as if writing to a
+    directory; outputs not writing to the file system store these paths
+    relative to it.
+    """
+
+    # whether files must be handed to the output in the process that created
+    # it, rather than written from worker processes
+    collects = False
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key_for(self, path):
+        return os.path.relpath(path, self.directory).replace(os.sep, '/')
+
+    def write(self, path, chunks):
+        """ Writes the given byte chunks as the file at the given path.
+        """
+        raise Exception("Cannot use abstract superclass' `write` method")
+
+    def copy(self, source_path, path):
+        with io.open(source_path, 'rb') as handle:
+            self.write(path, iter(lambda: handle.read(65536), b''))
+
+    def clear(self, directory):
+        """ Removes all files within the given directory.
+        """
+        raise Exception("Cannot use abstract superclass' `clear` method")
+
+    def finish(self):
+        """ Called once all files have been written.
+        """
+        pass
+
+
+class FHIRDirectoryOutput(FHIROutput):
+    """ Writes files to the file system.
+    """
+
+    def write(self, path, chunks):
+        dirpath = os.path.dirname(path)
+        if dirpath and not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        with io.open(path, 'wb') as handle:
+            for chunk in chunks:
+                handle.write(chunk)
+
+    def copy(self, source_path, path):
+        shutil.copyfile(source_path, path)
+
+    def clear(self, directory):
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+
+
+class FHIRMemoryOutput(FHIROutput):
+    """ Keeps files in the `files` dictionary, mapping paths relative to the
+    output directory to their content as bytes.
+    """
+    collects = True
+
+    def __init__(self, directory='.'):
+        super(FHIRMemoryOutput, self).__init__(directory)
+        self.files = {}
+
+    def write(self, path, chunks):
+        self.files[self.key_for(path)] = b''.join(chunks)
+
+    def clear(self, directory):
+        prefix = self.key_for(directory)
+        for key in list(self.files.keys()):
+            if '.' == prefix or key.startswith(prefix + '/'):
+                del self.files[key]
+
+
+class FHIRZipOutput(FHIRMemoryOutput):
+    """ Writes all files into one zip archive, in a single pass once all
+    files have been generated; files are named by their path relative to the
+    output directory.
+    """
+
+    def __init__(self, filepath, directory='.'):
+        super(FHIRZipOutput, self).__init__(directory)
+        self.filepath = filepath
+
+    def finish(self):
+        import zipfile
+        dirpath = os.path.dirname(self.filepath)
+        if dirpath and not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+
+        tmp_path = self.filepath + '.tmp'
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for key in sorted(self.files.keys()):
+                info = zipfile.ZipInfo(key, date_time=(1980, 1, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o644 << 16
+                archive.writestr(info, self.files[key])
+        os.replace(tmp_path, self.filepath)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+from concurrent import futures
+
+from fhirprofiler import profiler
+
+# calls handed to forked worker processes, which inherit this list and only
+# receive the index of the call to perform
+_pending_calls = None
+
+
+def _perform_pending_call(idx):
+    func, args = _pending_calls[idx]
+    return func(*args)
+
+
+def _perform_pending_call_measured(idx):
+    """ Performs a call in a worker process, also returning what the profiler
+    measured meanwhile.
+    """
+    mark = len(profiler.measurements)
+    result = _perform_pending_call(idx)
+    return result, profiler.measurements[mark:]
+
+
+def can_fork():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def perform(calls, num_jobs):
+    """ Performs a list of (callable, args) tuples and returns their results
+    in order.
+
+    With more than one job, the calls are spread across forked worker
+    processes. These inherit the calls, so callables and arguments need not
+    be picklable (only results are). Where forking is not available, threads
+    are used instead.
+    """
+    if num_jobs <= 1 or len(calls) <= 1:
+        return [func(*args) for func, args in calls]
+
+    if not can_fork():
+        # threads share the module, so each call is handed over as it is
+        with futures.ThreadPoolExecutor(num_jobs) as executor:
+            return list(executor.map(lambda call: call[0](*call[1]), calls))
+
+    global _pending_calls
+    previous = _pending_calls       # when called from within a worker
+    _pending_calls = calls
+    try:
+        executor = futures.ProcessPoolExecutor(min(num_jobs, len(calls)), mp_context=multiprocessing.get_context('fork'))
+        chunksize = max(1, len(calls) // (4 * num_jobs))
+        measured = profiler.enabled
+        with executor:
+            results = list(executor.map(_perform_pending_call_measured if measured else _perform_pending_call, range(len(calls)), chunksize=chunksize))
+        if measured:
+            for result, measurements in results:
+                profiler.measurements.extend(measurements)
+            results = [result for result, measurements in results]
+        return results
+    finally:
+        _pending_calls = previous
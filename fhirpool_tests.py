@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+import fhirpool
+
+
+def _item(tag, num):
+    time.sleep(0.005)
+    return (tag, num)
+
+
+def _items(tag):
+    return fhirpool.perform([(_item, (tag, num)) for num in range(8)], 4)
+
+
+class FHIRPoolTests(unittest.TestCase):
+
+    def expected(self):
+        return [[(tag, num) for num in range(8)] for tag in ['A', 'B']]
+
+    def testNested(self):
+        self.assertEqual(self.expected(), fhirpool.perform([(_items, ('A',)), (_items, ('B',))], 2))
+
+    def testNestedThreads(self):
+        can_fork = fhirpool.can_fork
+        fhirpool.can_fork = lambda: False
+        try:
+            self.assertEqual(self.expected(), fhirpool.perform([(_items, ('A',)), (_items, ('B',))], 2))
+        finally:
+            fhirpool.can_fork = can_fork
+
+
+if '__main__' == __name__:
+    unittest.main()
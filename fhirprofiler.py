@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+import collections
+
+try:
+    import resource
+except ImportError:         # not available on Windows
+    resource = None
+
+
+# one measured phase or item: `item` is None for a whole phase, `group` the
+# template for renders; memory is the growth of the peak RSS in MB
+FHIRMeasurement = collections.namedtuple('FHIRMeasurement', ['phase', 'item', 'group', 'start', 'duration', 'memory', 'pid', 'tid'])
+
+# the phases of a generator run, in order
+phases = ['download', 'parse', 'process_profile', 'finalize', 'unit_tests', 'write', 'render']
+
+# phases whose items are profiles
+profile_phases = ['parse', 'process_profile', 'finalize']
+
+
+def max_rss():
+    """ The peak resident set size of this process so far, in MB, or 0 where
+    it cannot be determined.
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if 'darwin' == sys.platform else peak / 1024   # bytes on macOS, KB elsewhere
+
+
+class FHIRProfiler(object):
+    """ Measures time and memory of generator phases and of the items, like
+    profiles or rendered files, processed in them.
+
+    Does nothing unless enabled. Measurements taken in worker processes are
+    handed back by `fhirpool.perform`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.measurements = []
+
+    @contextlib.contextmanager
+    def measure(self, phase, item=None, group=None):
+        """ Context manager measuring the enclosed code as one item of the
+        given phase or, without item, as the phase itself.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start = time.time()
+        clock = time.perf_counter()
+        memory = max_rss()
+        try:
+            yield
+        finally:
+            self.measurements.append(FHIRMeasurement(phase, item, group, start, time.perf_counter() - clock,
+                max_rss() - memory, os.getpid(), threading.get_ident()))
+
+
+    # MARK: Reporting
+
+    def report(self, limit=10):
+        """ Prints a table of all phases and of the slowest profiles and
+        templates.
+        """
+        print('{:<18}{:>8}{:>12}{:>14}'.format('phase', 'items', 'time (s)', 'memory (MB)'))
+        for phase in phases:
+            whole = [meas for meas in self.measurements if phase == meas.phase and meas.item is None]
+            items = [meas for meas in self.measurements if phase == meas.phase and meas.item is not None]
+            if len(whole) + len(items) > 0:
+                measured = whole if len(whole) > 0 else items
+                print('{:<18}{:>8}{:>12.3f}{:>14.1f}'.format(phase, len(items),
+                    sum(meas.duration for meas in measured), sum(meas.memory for meas in measured)))
+
+        profiles = self._totals([meas for meas in self.measurements if meas.phase in profile_phases and meas.item is not None], 'item')
+        self._report_slowest('profile', profiles, limit)
+        templates = self._totals([meas for meas in self.measurements if 'render' == meas.phase], 'group')
+        self._report_slowest('template', templates, limit)
+
+    def _totals(self, measurements, key):
+        totals = collections.OrderedDict()
+        for meas in measurements:
+            name = getattr(meas, key)
+            count, duration, memory = totals.get(name, (0, 0, 0))
+            totals[name] = (count + 1, duration + meas.duration, memory + meas.memory)
+        return totals
+
+    def _report_slowest(self, title, totals, limit):
+        if 0 == len(totals):
+            return
+        print('')
+        print('{:<40}{:>8}{:>12}{:>14}'.format('slowest {}s'.format(title), 'count', 'time (s)', 'memory (MB)'))
+        for name, (count, duration, memory) in sorted(totals.items(), key=lambda item: -item[1][1])[:limit]:
+            print('{:<40}{:>8}{:>12.3f}{:>14.1f}'.format(name, count, duration, memory))
+
+    def write_trace(self, filepath):
+        """ Writes all measurements as JSON in the Trace Event Format, which
+        can be viewed in Chrome's about:tracing or Perfetto.
+        """
+        events = []
+        for meas in self.measurements:
+            events.append({
+                'name': meas.phase if meas.item is None else meas.item,
+                'cat': meas.phase,
+                'ph': 'X',
+                'ts': int(meas.start * 1000000),
+                'dur': int(meas.duration * 1000000),
+                'pid': meas.pid,
+                'tid': meas.tid,
+                'args': {'memory': meas.memory, 'template': meas.group} if meas.group else {'memory': meas.memory},
+            })
+        with io.open(filepath, 'w', encoding='utf-8') as handle:
+            json.dump({'traceEvents': events}, handle)
+
+
+# the profiler used throughout a generator run
+profiler = FHIRProfiler()
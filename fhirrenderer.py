@@ -1,50 +1,126 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import io
 import os
 import re
-import shutil
 import textwrap
 
-from jinja2 import Environment, PackageLoader
+from jinja2 import Environment, PackageLoader, FileSystemBytecodeCache
 from jinja2.filters import environmentfilter
 from logger import logger
+from fhirprofiler import profiler
+import fhirpool
+import fhiroutput
+import fhirmanifest
 
 jinjaenv = Environment(loader=PackageLoader('generate', '.'))
 
 
+def use_bytecode_cache(directory):
+    """ Keep compiled templates in the given directory, so they only need to
+    be compiled again when their source changes.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    jinjaenv.bytecode_cache = FileSystemBytecodeCache(directory)
+
 class FHIRRenderer(object):
-    def __init__(self, spec, settings):
+    def __init__(self, spec, settings, manifest=None, sink=None):
         self.spec = spec
         self.settings = settings
+        self.manifest = manifest
+        self.sink = sink or fhiroutput.FHIRDirectoryOutput(None)
+        self._templates = {}
+        if manifest is not None:
+            manifest.activate(self.manifest_group)
+    
+    @property
+    def manifest_group(self):
+        return self.__class__.__name__
     
     def render(self, output):
         """ The main rendering start point, for subclasses to override.
         """
         raise Exception("Cannot use abstract superclass' `render` method")
     
+    def inputs_hash(self, template_path, inputs):
+        """ Returns a hash over everything a rendered file depends on: the
+        template, the settings, the spec version and the given list of
+        additional inputs. Mappings are left out; renders depend on the
+        entries they use through the signatures of their classes in `inputs`.
+        Returns None when not writing incrementally.
+        """
+        if self.manifest is None:
+            return None
+        return fhirmanifest.hash_of(self.manifest.template_hash(template_path),
+            fhirmanifest.hash_of_settings(self.settings, fhirmanifest.settings_reflected_in_classes),
+            self.spec.info.version, self.spec.info.date, *inputs)
+    
+    def template_for(self, template_path):
+        template = self._templates.get(template_path)
+        if template is None:
+            assert os.path.exists(template_path)
+            template = jinjaenv.get_template(template_path)
+            self._templates[template_path] = template
+        return template
+    
+    def do_render_all(self, renders):
+        """ Render a list of (data, template_path, target_path, inputs)
+        tuples, `inputs` being a list of strings the rendered file depends on
+        (see `inputs_hash`).
+        
+        When writing incrementally, renders whose inputs have not changed are
+        skipped. If `settings.render_jobs` is larger than 1, the renders are
+        spread across forked worker processes (or threads where forking is not
+        available). Every file is rendered exactly as in a serial run. Sinks
+        that collect files get them handed from the workers.
+        """
+        hashes = []
+        pending = []
+        for data, template_path, target_path, inputs in renders:
+            inputs_hash = self.inputs_hash(template_path, inputs)
+            if self.manifest is not None and self.manifest.is_current(target_path, inputs_hash):
+                continue
+            hashes.append(inputs_hash)
+            pending.append((data, template_path, target_path))
+        
+        results = fhirpool.perform([(self.do_render, render) for render in pending], self.settings.render_jobs)
+        
+        if self.manifest is not None:
+            for render, inputs_hash, content_hash in zip(pending, hashes, results):
+                self.manifest.record(render[2], inputs_hash, content_hash, self.manifest_group)
+        elif self.sink.collects:
+            for render, content in zip(pending, results):
+                self.sink.write(render[2], [content])
+    
     def do_render(self, data, template_path, target_path):
-        """ Render the given data using a Jinja2 template, writing to the file
-        at the target path.
+        """ Render the given data using a Jinja2 template, streaming the
+        output to the file at the target path.
         
         :param template_path: Path to the Jinja2 template to render
         :param target_path: Output path
+        :returns: The hash of the rendered content when writing incrementally,
+            the content itself if the sink collects files
         """
-        assert os.path.exists(template_path)
-        template = jinjaenv.get_template(template_path)
-        
         if not target_path:
             raise Exception("No target filepath provided")
-        dirpath = os.path.dirname(target_path)
-        if not os.path.isdir(dirpath):
-            os.makedirs(dirpath)
         
-        with io.open(target_path, 'w', encoding='utf-8') as handle:
-            logger.info('Writing {}'.format(target_path))
-            rendered = template.render(data)
-            handle.write(rendered)
-            # handle.write(rendered.encode('utf-8'))
+        with profiler.measure('render', target_path, template_path):
+            template = self.template_for(template_path)
+            chunks = (chunk.encode('utf-8') for chunk in template.generate(data))
+            
+            # incrementally: leave the file untouched if its content is the same
+            if self.manifest is not None:
+                did_write, content_hash = fhirmanifest.write_if_changed(target_path, chunks)
+                if did_write:
+                    logger.info('Writing %s', target_path)
+                return content_hash
+            
+            logger.info('Writing %s', target_path)
+            if self.sink.collects:          # may be in a worker process, see `do_render_all`
+                return b''.join(chunks)
+            self.sink.write(target_path, chunks)
+            return None
 
 
 class FHIRStructureDefinitionRenderer(FHIRRenderer):
@@ -52,32 +128,40 @@ class FHIRStructureDefinitionRenderer(FHIRRenderer):
     """    
     def copy_files(self, output):
         """ Copy base resources to the target location, according to settings.
+        
+        When writing incrementally, the target directory is not cleared but
+        stale files are removed via the manifest.
         """
         resource_target_dir = os.path.dirname(self.settings.tpl_resource_target_ptrn.format(output, ''))
-        if os.path.isdir(resource_target_dir):
-            shutil.rmtree(resource_target_dir)
+        if self.manifest is None:
+            self.sink.clear(resource_target_dir)
 
-        if not os.path.isdir(resource_target_dir):
-            os.mkdir(resource_target_dir)
+        if not self.sink.collects and not os.path.isdir(resource_target_dir):
+            os.makedirs(resource_target_dir)
 
         for filepath, module, contains in self.settings.manual_profiles:
             if os.path.exists(filepath):
                 tgt = os.path.join(resource_target_dir, os.path.basename(filepath))
-                logger.info("Copying manual profiles in {} to {}".format(os.path.basename(filepath), tgt))
-                shutil.copyfile(filepath, tgt)
+                if self.manifest is not None:
+                    self.manifest.copy_file(filepath, tgt, self.manifest_group)
+                else:
+                    logger.info('Copying manual profiles in %s to %s', os.path.basename(filepath), tgt)
+                    self.sink.copy(filepath, tgt)
     
     def render(self, output):
+        renders = []
         for profile in self.spec.writable_profiles():
             classes = sorted(profile.writable_classes(), key=lambda x: x.name)
             if 0 == len(classes):
                 if profile.url is not None:        # manual profiles have no url and usually write no classes
-                    logger.info('Profile "{}" returns zero writable classes, skipping'.format(profile.url))
+                    logger.info('Profile "%s" returns zero writable classes, skipping', profile.url)
                 continue
             
             imports = profile.needed_external_classes()
             data = {
                 'profile': profile,
                 'info': self.spec.info,
+                'settings': self.settings,
                 'imports': imports,
                 'classes': classes
             }
@@ -86,7 +170,13 @@ class FHIRStructureDefinitionRenderer(FHIRRenderer):
             source_path = self.settings.tpl_resource_source
             target_path = self.settings.tpl_resource_target_ptrn.format(output, ptrn)
             
-            self.do_render(data, source_path, target_path)
+            # the module depends on its own profile and classes and the profiles and names of all imported classes
+            inputs = [profile.content_hash] + sorted(set([imp.profile.content_hash or '' for imp in imports]))
+            inputs.extend([klass.signature() for klass in classes])
+            inputs.extend(sorted(set([repr((imp.name, imp.module)) for imp in imports])))
+            renders.append((data, source_path, target_path, inputs))
+        
+        self.do_render_all(renders)
 
 
 class FHIRFactoryRenderer(FHIRRenderer):
@@ -101,7 +191,9 @@ class FHIRFactoryRenderer(FHIRRenderer):
             'info': self.spec.info,
             'classes': sorted(classes, key=lambda x: x.name),
         }
-        self.do_render(data, self.settings.tpl_factory_source, self.settings.tpl_factory_target.format(output))
+        inputs = sorted([profile.content_hash or '' for profile in self.spec.writable_profiles()])
+        inputs.extend([repr((klass.name, klass.module, klass.resource_name)) for klass in data['classes']])
+        self.do_render_all([(data, self.settings.tpl_factory_source, self.settings.tpl_factory_target.format(output), inputs)])
 
 
 class FHIRUnitTestRenderer(FHIRRenderer):
@@ -111,7 +203,26 @@ class FHIRUnitTestRenderer(FHIRRenderer):
         if self.spec.unit_tests is None:
             return
         
-        # render all unit test collections
+        if self.settings.unittest_data_driven:
+            self.render_data_driven(output)
+        else:
+            self.render_per_class(output)
+        
+        # copy unit test files, if any
+        if self.settings.unittest_copyfiles is not None:
+            for utfile in self.settings.unittest_copyfiles:
+                if os.path.exists(utfile):
+                    target = os.path.join(os.path.dirname(self.settings.tpl_unittest_target_ptrn.format(output, '')), os.path.basename(utfile))
+                    if self.manifest is not None:
+                        self.manifest.copy_file(utfile, target, self.manifest_group)
+                    else:
+                        logger.info('Copying unittest file %s to %s', os.path.basename(utfile), target)
+                        self.sink.copy(utfile, target)
+    
+    def render_per_class(self, output):
+        """ Renders a test module for every unit test collection.
+        """
+        renders = []
         for coll in self.spec.unit_tests:
             data = {
                 'info': self.spec.info,
@@ -124,15 +235,39 @@ class FHIRUnitTestRenderer(FHIRRenderer):
                 file_pattern = file_pattern.lower()
             file_path = self.settings.tpl_unittest_target_ptrn.format(output, file_pattern)
             
-            self.do_render(data, self.settings.tpl_unittest_source, file_path)
+            # the test module depends on nothing but the test cases it renders
+            inputs = [coll.klass.name, coll.klass.module]
+            for test in coll.tests:
+                inputs.append(test.filename)
+                inputs.extend([repr((t.path, t.value, t.klass.name)) for t in test.tests])
+            renders.append((data, self.settings.tpl_unittest_source, file_path, inputs))
         
-        # copy unit test files, if any
-        if self.settings.unittest_copyfiles is not None:
-            for utfile in self.settings.unittest_copyfiles:
-                if os.path.exists(utfile):
-                    target = os.path.join(os.path.dirname(self.settings.tpl_unittest_target_ptrn.format(output, '')), os.path.basename(utfile))
-                    logger.info('Copying unittest file {} to {}'.format(os.path.basename(utfile), target))
-                    shutil.copyfile(utfile, target)
+        self.do_render_all(renders)
+    
+    def render_data_driven(self, output):
+        """ Renders all test values into one manifest of path, value and type
+        triples, along with one test module that checks them.
+        """
+        if not self.settings.tpl_unittest_manifest_source or not self.settings.tpl_unittest_runner_source:
+            raise Exception("Data-driven unit tests are not available for this language")
+        
+        manifest_path = self.settings.tpl_unittest_manifest_target.format(output)
+        data = {
+            'info': self.spec.info,
+            'collections': self.spec.unit_tests,
+            'manifest': os.path.basename(manifest_path),
+        }
+        inputs = []
+        for coll in self.spec.unit_tests:
+            inputs.extend([coll.klass.name, coll.klass.module])
+            for test in coll.tests:
+                inputs.append(test.filename)
+                inputs.extend([repr((t.path, t.value, t.klass.name)) for t in test.tests])
+        
+        self.do_render_all([
+            (data, self.settings.tpl_unittest_manifest_source, manifest_path, inputs),
+            (data, self.settings.tpl_unittest_runner_source, self.settings.tpl_unittest_runner_target.format(output), [data['manifest']]),
+        ])
 
 
 # There is a bug in Jinja's wordwrap (inherited from `textwrap`) in that it
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import glob
+import pickle
+
+from logger import logger
+import fhirspec
+import fhirclass
+import fhirbundle
+import fhirloader
+import fhirunittest
+import fhirmanifest
+
+
+class FHIRSpecSnapshot(object):
+    """ A pickled copy of a parsed and finalized FHIRSpec, including its
+    classes and, once parsed, its unit test collections.
+
+    Snapshots are keyed by a hash over the spec files, the settings (which
+    include the mappings) and the parser's own source, so they are only
+    loaded when parsing would produce the same result.
+    """
+
+    # how many snapshots, e.g. for different languages or spec versions, to keep
+    keep = 4
+
+    def __init__(self, directory, spec_source, settings):
+        self.directory = directory
+        self.settings = settings
+        self.key = self.compute_key(spec_source)
+        self.filepath = os.path.join(directory, '{}.pickle'.format(self.key))
+        self._has_unit_tests = False
+
+    def compute_key(self, spec_source):
+        names = ['version.info'] + fhirspec.FHIRSpec.profile_bundles
+        names.extend(res.name for res in fhirunittest.FHIRResourceFile.find_all(spec_source))
+        hashes = [spec_source.fingerprint(name) for name in names]
+
+        modules = [fhirspec, fhirclass, fhirbundle, fhirloader, fhirunittest]
+        hashes.extend([os.path.basename(module.__file__) + fhirmanifest.hash_of_file(module.__file__) for module in modules])
+        hashes.append(fhirmanifest.hash_of_settings(self.settings))
+        hashes.append(str(self.settings.incremental))       # decides whether profiles are hashed
+        return fhirmanifest.hash_of(*hashes)
+
+    def load(self):
+        """ Loads the spec from the snapshot, if there is one.
+
+        :returns: A FHIRSpec instance or None
+        """
+        if not os.path.exists(self.filepath):
+            return None
+
+        logger.info('Loading parsed spec from snapshot {}'.format(self.filepath))
+        with io.open(self.filepath, 'rb') as handle:
+            unpickler = pickle.Unpickler(handle)
+            unpickler.persistent_load = self._persistent_load
+            spec = unpickler.load()
+
+        spec.info = fhirspec.FHIRVersionInfo(spec, spec.source)      # today's date, unless deterministic
+        self._has_unit_tests = spec.unit_tests is not None
+        return spec
+
+    def save(self, spec):
+        """ Writes the snapshot, unless an up-to-date one has been loaded, and
+        removes the oldest snapshots with other keys.
+        """
+        if os.path.exists(self.filepath) and (self._has_unit_tests or spec.unit_tests is None):
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        others = [path for path in glob.glob(os.path.join(self.directory, '*.pickle')) if path != self.filepath]
+        for path in sorted(others, key=os.path.getmtime)[:max(0, len(others) - self.keep + 1)]:
+            os.remove(path)
+
+        logger.info('Writing snapshot of parsed spec to {}'.format(self.filepath))
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 20000))         # the element hierarchy is deeply nested
+        try:
+            tmp_path = self.filepath + '.tmp'
+            with io.open(tmp_path, 'wb') as handle:
+                pickler = pickle.Pickler(handle, pickle.HIGHEST_PROTOCOL)
+                pickler.persistent_id = self._persistent_id
+                pickler.dump(spec)
+            os.replace(tmp_path, self.filepath)
+        finally:
+            sys.setrecursionlimit(limit)
+        self._has_unit_tests = spec.unit_tests is not None
+
+
+    # MARK: Pickling
+
+    def _persistent_id(self, obj):
+        """ The settings module cannot be pickled; it is referenced by name
+        and replaced with the current settings when loading.
+        """
+        if obj is self.settings:
+            return 'settings'
+        return None
+
+    def _persistent_load(self, pid):
+        if 'settings' == pid:
+            return self.settings
+        raise pickle.UnpicklingError('Unknown persistent id "{}"'.format(pid))
@@ -7,12 +7,20 @@ import re
 import sys
 import glob
 import json
+import pickle
+import hashlib
 import datetime
 
 from logger import logger
+from fhirprofiler import profiler
+import fhirpool
 import fhirclass
+import fhirbundle
+import fhirloader
 import fhirunittest
 import fhirrenderer
+import fhiroutput
+import fhirmanifest
 
 # allow to skip some profiles by matching against their url (used while WiP)
 skip_because_unsupported = [
@@ -24,18 +32,49 @@ class FHIRSpec(object):
     """ The FHIR specification.
     """
     
-    def __init__(self, directory, settings):
-        assert os.path.isdir(directory)
+    # the bundles containing the profiles to parse
+    profile_bundles = ['profiles-types.json', 'profiles-resources.json'] #, 'profiles-others.json']
+    
+    def __init__(self, source, settings, read=True):
+        if not isinstance(source, fhirloader.FHIRSpecSource):
+            source = fhirloader.FHIRSpecSource(source)
         assert settings is not None
-        self.directory = directory
+        self.source = source
+        self.directory = source.directory
         self.settings = settings
-        self.info = FHIRVersionInfo(self, directory)
+        self.info = FHIRVersionInfo(self, source)
         self.profiles = {}              # profile-name: FHIRStructureDefinition()
+        self.known_classes = {}         # class-name: FHIRClass()
         self.unit_tests = None          # FHIRUnitTestCollection()
+        self.example_files = None       # FHIRResourceFile(), if shared with other specs
         
-        self.prepare()
-        self.read_profiles()
-        self.finalize()
+        if read:
+            self.prepare()
+            self.read_profiles()
+            self.finalize()
+    
+    @classmethod
+    def read_shared(cls, source, all_settings):
+        """ Reads the spec once for several languages.
+        
+        Every StructureDefinition is decoded only once and handed to one
+        FHIRSpec per settings module, each of which applies its language's
+        naming, and all specs share the same example files.
+        
+        :returns: A list of FHIRSpec instances, in the order of `all_settings`
+        """
+        specs = [cls(source, settings, read=False) for settings in all_settings]
+        for spec in specs:
+            spec.prepare()
+        for resource in cls.structure_definitions(source, cls.selected_positions(source, all_settings)):
+            for spec in specs:
+                spec.read_profile(resource)
+        
+        example_files = fhirunittest.FHIRResourceFile.find_all(source)
+        for spec in specs:
+            spec.finalize()
+            spec.example_files = example_files
+        return specs
     
     def prepare(self):
         """ Run actions before starting to parse profiles.
@@ -45,42 +84,170 @@ class FHIRSpec(object):
     
     # MARK: Handling Profiles
     
-    def read_profiles(self):
-        """ Find all (JSON) profiles and instantiate into FHIRStructureDefinition.
+    @classmethod
+    def structure_definitions(cls, source, positions=None, with_text=False):
+        """ Generator yielding all StructureDefinitions found in the profile
+        bundles of the given spec source, or only those at the given
+        positions (see `FHIRStructureDefinitionIndex`).
+        
+        Bundles are read one entry at a time, so only one raw profile
+        dictionary is held in memory. With `with_text`, yields tuples of the
+        StructureDefinition and the JSON text of its Bundle entry.
         """
-        resources = []
-        for filename in ['profiles-types.json', 'profiles-resources.json']: #, 'profiles-others.json']:
-            filepath = os.path.join(self.directory, filename)
-            with io.open(filepath, encoding='utf-8') as handle:
-                parsed = json.load(handle)
-                assert parsed is not None
-                assert 'resourceType' in parsed
-                assert 'Bundle' == parsed['resourceType']
-                assert 'entry' in parsed
-                
-                # find resources in entries
-                for entry in parsed['entry']:
-                    resource = entry.get('resource')
-                    if resource is not None:
-                        assert 'resourceType' in resource
-                        if 'StructureDefinition' == resource['resourceType']:
-                            resources.append(resource)
-                    else:
-                        logging.warning('There is no resource in this entry: {}'
-                            .format(entry))
+        for filename in cls.profile_bundles:
+            last = None
+            if positions is not None:
+                last = max([pos for name, pos in positions if name == filename] or [-1])
+                if last < 0:
+                    continue
+            with source.open(filename) as handle:
+                reader = fhirbundle.FHIRBundleReader(handle)
+                for pos, resource in enumerate(reader.resources('StructureDefinition', with_text)):
+                    if positions is None or (filename, pos) in positions:
+                        yield resource
+                    if last is not None and pos >= last:      # no need to read the rest
+                        break
+    
+    @classmethod
+    def selected_positions(cls, source, all_settings):
+        """ Determines the positions of the profiles to read if the settings
+        only ask for some profiles, see `settings.only_profiles`.
+        
+        :returns: A set of (bundle, position) tuples or None for all profiles
+        """
+        names = all_settings[0].only_profiles
+        if not names:
+            return None
+        star_types = set()
+        for settings in all_settings:
+            star_types.update(settings.starexpandtypes)
+        index = FHIRStructureDefinitionIndex(source, cls.profile_bundles)
+        return index.closure(names, star_types)
+    
+    def read_profiles(self):
+        """ Find all (JSON) profiles and instantiate into FHIRStructureDefinition,
+        processing every profile right away.
         
-        # create profile instances
-        for resource in resources:
+        With `settings.render_jobs` larger than 1, and where processes can be
+        forked, profiles are processed in worker processes, see
+        `read_profile_shard`. Bundles are decoded once, here, keeping the
+        JSON text of each entry for the worker processing it.
+        """
+        positions = self.selected_positions(self.source, [self.settings])
+        num_jobs = self.settings.render_jobs
+        if num_jobs <= 1 or not fhirpool.can_fork():
+            for resource in self.structure_definitions(self.source, positions):
+                self.read_profile(resource)
+            return
+        
+        shards = [[] for shard in range(num_jobs)]
+        names = []
+        for idx, (resource, text) in enumerate(self.structure_definitions(self.source, positions, True)):
+            shards[idx % num_jobs].append((idx, text))
+            name = None
+            if not self.is_unsupported(resource.get('url')):
+                name = self.class_name_for_profile(resource.get('name'))
+            names.append(name.lower() if name else None)
+        
+        registry = (dict(self.profiles), dict(self.known_classes))
+        calls = [(self.read_profile_shard, (entries, names, registry)) for entries in shards]
+        processed = []
+        for data in fhirpool.perform(calls, num_jobs):
+            processed.extend(self._unpickle_profiles(data))
+        for idx, profile in sorted(processed, key=lambda item: item[0]):
+            self.merge_profile(profile)
+    
+    def read_profile(self, resource):
+        """ Instantiate and process one StructureDefinition, unless it is
+        unsupported.
+        
+        :returns: The processed FHIRStructureDefinition or None if it has been
+            skipped or discarded
+        """
+        with profiler.measure('parse', resource.get('name')):
             profile = FHIRStructureDefinition(self, resource)
-            for pattern in skip_because_unsupported:
-                if re.search(pattern, profile.url) is not None:
-                    logger.info('Skipping "{}"'.format(resource['url']))
-                    profile = None
-                    break
-            
-            if profile is not None and self.found_profile(profile):
-                profile.process_profile()
-                    
+        if self.is_unsupported(profile.url):
+            logger.info('Skipping "%s"', resource['url'])
+            return None
+        
+        if not self.found_profile(profile):
+            return None
+        with profiler.measure('process_profile', profile.name):
+            profile.process_profile()
+        return profile
+    
+    def is_unsupported(self, url):
+        for pattern in skip_because_unsupported:
+            if re.search(pattern, url) is not None:
+                return True
+        return False
+    
+    
+    # MARK: Processing Profiles in Worker Processes
+    
+    def read_profile_shard(self, entries, names, registry):
+        """ Processes the given StructureDefinitions in a forked worker
+        process, decoding only their entries.
+        
+        The names of all profiles before each one, as found in `names` by
+        index, are registered so that the same profiles are discarded as in
+        a serial run. Classes are registered with this process' copy of the
+        spec only, starting from the given (profiles, known_classes)
+        registry, the parent merges them with `merge_profile`.
+        
+        :param entries: (index, "json-text") tuples of the Bundle entries to
+            process, in order
+        :param names: The lowercase class names of all profiles, by index,
+            or None for unsupported ones
+        :returns: Pickled (index, FHIRStructureDefinition) tuples, referencing
+            the spec by persistent id
+        """
+        self.profiles = dict(registry[0])         # a worker may process several shards
+        self.known_classes = dict(registry[1])
+        processed = []
+        registered = 0
+        for idx, text in entries:
+            for name in names[registered:idx]:
+                if name and name not in self.profiles:
+                    self.profiles[name] = None          # processed by another shard
+            registered = idx + 1
+            profile = self.read_profile(json.loads(text)['resource'])
+            if profile is not None:
+                processed.append((idx, profile))
+        
+        pickler_data = io.BytesIO()
+        pickler = pickle.Pickler(pickler_data, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = lambda obj: 'spec' if obj is self else None
+        pickler.dump(processed)
+        return pickler_data.getvalue()
+    
+    def _unpickle_profiles(self, data):
+        def persistent_load(pid):
+            if 'spec' == pid:
+                return self
+            raise pickle.UnpicklingError('Unknown persistent id "{}"'.format(pid))
+        
+        unpickler = pickle.Unpickler(io.BytesIO(data))
+        unpickler.persistent_load = persistent_load
+        return unpickler.load()
+    
+    def merge_profile(self, profile):
+        """ Adds a profile processed in a worker process, in bundle order.
+        
+        A class already known from a previous profile replaces the one created
+        by the worker, like in a serial run, where the previous profile's class
+        would have been reused without adding properties.
+        """
+        if not self.found_profile(profile):
+            return
+        classes = []
+        for klass in profile.classes:
+            known = self.known_classes.get(klass.name)
+            if known is None:
+                self.known_classes[klass.name] = klass
+                known = klass
+            classes.append(known)
+        profile.classes = classes
     
     def found_profile(self, profile):
         if not profile or not profile.name:
@@ -112,13 +279,17 @@ class FHIRSpec(object):
                 if self.found_profile(profile):
                     profile.process_profile()
     
+    def class_with_name(self, class_name):
+        return self.known_classes.get(class_name)
+    
     def finalize(self):
         """ Should be called after all profiles have been parsed and allows
         to perform additional actions, like looking up class implementations
         from different profiles.
         """
         for key, prof in self.profiles.items():
-            prof.finalize()
+            with profiler.measure('finalize', prof.name):
+                prof.finalize()
     
     
     # MARK: Naming Utilities
@@ -174,7 +345,7 @@ class FHIRSpec(object):
     
     def parse_unit_tests(self):
         controller = fhirunittest.FHIRUnitTestController(self)
-        controller.find_and_parse_tests(self.directory)
+        controller.find_and_parse_tests(self.source, self.example_files)
         self.unit_tests = controller.collections
     
     
@@ -188,26 +359,49 @@ class FHIRSpec(object):
         return profiles
     
     def write(self, output):
-        if self.settings.write_resources:
-            renderer = fhirrenderer.FHIRStructureDefinitionRenderer(self, self.settings)
-            renderer.copy_files(output)
-            renderer.render(output)
-        
-        if self.settings.write_factory:
-            renderer = fhirrenderer.FHIRFactoryRenderer(self, self.settings)
-            renderer.render(output)
-        
-        if self.settings.write_unittests:
-            self.parse_unit_tests()
-            renderer = fhirrenderer.FHIRUnitTestRenderer(self, self.settings)
-            renderer.render(output)
+        """ Writes all files as configured in settings.
+        
+        :param output: The output directory or a `FHIROutput`, e.g. to write
+            into memory or a zip archive
+        :returns: The FHIROutput written to
+        """
+        sink = output if isinstance(output, fhiroutput.FHIROutput) else fhiroutput.FHIRDirectoryOutput(output)
+        output = sink.directory
+        with profiler.measure('write', output):
+            manifest = None
+            if self.settings.incremental and not sink.collects:
+                manifest = fhirmanifest.FHIRManifest(output)
+            
+            if self.settings.write_resources:
+                renderer = fhirrenderer.FHIRStructureDefinitionRenderer(self, self.settings, manifest, sink)
+                renderer.copy_files(output)
+                renderer.render(output)
+            
+            if self.settings.write_factory:
+                renderer = fhirrenderer.FHIRFactoryRenderer(self, self.settings, manifest, sink)
+                renderer.render(output)
+            
+            if self.settings.write_unittests:
+                if self.unit_tests is None:
+                    self.parse_unit_tests()
+                renderer = fhirrenderer.FHIRUnitTestRenderer(self, self.settings, manifest, sink)
+                renderer.render(output)
+            
+            if manifest is not None:
+                manifest.finish()
+            sink.finish()
+        return sink
 
 
 class FHIRVersionInfo(object):
     """ The version of a FHIR specification.
+    
+    In deterministic mode, `date` and `year` are pinned to the build date of
+    the spec instead of today's date, so unchanged specs generate identical
+    files.
     """
     
-    def __init__(self, spec, directory):
+    def __init__(self, spec, source):
         self.spec = spec
         
         now = datetime.date.today()
@@ -215,18 +409,87 @@ class FHIRVersionInfo(object):
         self.year = now.year
         
         self.version = None
-        infofile = os.path.join(directory, 'version.info')
-        self.read_version(infofile)
-    
-    def read_version(self, filepath):
-        assert os.path.isfile(filepath)
-        with io.open(filepath, 'r', encoding='utf-8') as handle:
+        self.build_date = None
+        self.read_version(source, 'version.info')
+        
+        if spec.settings.deterministic:
+            if self.build_date is not None:
+                self.date = self.build_date.isoformat()
+                self.year = self.build_date.year
+            else:
+                logger.warning('No build date in version.info, cannot pin the generation date')
+    
+    def read_version(self, source, filename):
+        assert source.exists(filename)
+        with source.open(filename) as handle:
             text = handle.read()
             for line in text.split("\n"):
                 if '=' in line:
                     (n, v) = line.strip().split('=', 2)
                     if 'FhirVersion' == n:
                         self.version = v
+                    elif 'date' == n:
+                        try:
+                            self.build_date = datetime.datetime.strptime(v[:8], '%Y%m%d').date()
+                        except ValueError:
+                            logger.warning('Unparseable build date "{}" in version.info'.format(v))
+
+
+class FHIRStructureDefinitionIndex(object):
+    """ The positions of all StructureDefinitions in the profile bundles, by
+    name and URL, and the names of the StructureDefinitions each one needs:
+    its base and the types of its elements. These are the superclasses and
+    property classes that `needed_external_classes` will ask for.
+    """
+    
+    def __init__(self, source, bundles):
+        self.positions = {}         # lowercase name or url: (bundle, position)
+        self.dependencies = {}      # (bundle, position): set of names
+        
+        for filename in bundles:
+            with source.open(filename) as handle:
+                reader = fhirbundle.FHIRBundleReader(handle)
+                for pos, resource in enumerate(reader.resources('StructureDefinition')):
+                    self.add(resource, (filename, pos))
+    
+    def add(self, resource, position):
+        for key in [resource.get('name'), resource.get('url')]:
+            if key and key.lower() not in self.positions:
+                self.positions[key.lower()] = position
+        
+        needs = set()
+        if resource.get('base'):
+            needs.add(resource['base'].split('/')[-1])
+        for element in resource.get('differential', {}).get('element', []):
+            for type_dict in element.get('type', []):
+                if type_dict.get('code'):
+                    needs.add(type_dict['code'])
+        self.dependencies[position] = needs
+    
+    def closure(self, names, star_types):
+        """ The positions of the StructureDefinitions with the given names or
+        URLs and of all they need, transitively. The wildcard type "*" needs
+        all of `star_types`.
+        
+        :returns: A set of (bundle, position) tuples
+        """
+        pending = []
+        for name in names:
+            if name.lower() not in self.positions:
+                raise Exception('There is no StructureDefinition named "{}"'.format(name))
+            pending.append(self.positions[name.lower()])
+        
+        found = set()
+        while len(pending) > 0:
+            position = pending.pop()
+            if position in found:
+                continue
+            found.add(position)
+            for needed in self.dependencies[position]:
+                for type_name in (star_types if '*' == needed else [needed]):
+                    if type_name.lower() in self.positions:     # primitives may have no StructureDefinition
+                        pending.append(self.positions[type_name.lower()])
+        return found
 
 
 class FHIRStructureDefinition(object):
@@ -237,10 +500,12 @@ class FHIRStructureDefinition(object):
         self.is_manual = False
         self.spec = spec
         self.url = None
+        self.content_hash = None
         self.targetname = None
         self.structure = None
         self.elements = None
         self.main_element = None
+        self._elements_by_name = None
         self._class_map = {}
         self.classes = []
         self._did_finalize = False
@@ -270,20 +535,26 @@ class FHIRStructureDefinition(object):
         
         # parse structure
         self.url = profile.get('url')
-        logger.info('Parsing profile "{}"'.format(profile.get('name')))
+        if self.spec.settings.incremental:
+            self.content_hash = hashlib.sha1(json.dumps(profile, sort_keys=True).encode('utf-8')).hexdigest()
+        logger.info('Parsing profile "%s"', profile.get('name'))
         self.structure = FHIRStructureDefinitionStructure(self, profile)
     
     def process_profile(self):
-        """ Extract all elements and create classes.
+        """ Extract all elements and create classes, then release the raw
+        element dictionaries and the elements.
         """
-        struct = self.structure.differential# or self.structure.snapshot
+        struct = self.structure.differential
         if struct is not None:
             mapped = {}
             self.elements = []
+            self._elements_by_name = {}
             for elem_dict in struct:
                 element = FHIRStructureDefinitionElement(self, elem_dict, self.main_element is None)
                 self.elements.append(element)
                 mapped[element.path] = element
+                if element.definition.name is not None and element.definition.name not in self._elements_by_name:
+                    self._elements_by_name[element.definition.name] = element
                 
                 # establish hierarchy (may move to extra loop in case elements are no longer in order)
                 if element.is_main_profile_element:
@@ -295,6 +566,9 @@ class FHIRStructureDefinition(object):
             # resolve element dependencies
             for element in self.elements:
                 element.resolve_dependencies()
+            
+            # the raw element dictionaries are no longer needed
+            self.structure.differential = None
         
         # create classes and class properties
         if self.main_element is not None:
@@ -307,12 +581,15 @@ class FHIRStructureDefinition(object):
             for sub in subs:
                 self.found_class(sub)
             self.targetname = snap_class.name
+        
+        # the classes are all we need from the elements
+        self.elements = None
+        self.main_element = None
+        self._elements_by_name = None
     
     def element_with_name(self, name):
-        if self.elements is not None:
-            for element in self.elements:
-                if element.definition.name == name:
-                    return element
+        if self._elements_by_name is not None:
+            return self._elements_by_name.get(name)
         return None
     
     
@@ -345,7 +622,7 @@ class FHIRStructureDefinition(object):
             for prop in klass.properties:
                 prop_cls_name = prop.class_name
                 if prop_cls_name not in internal and not self.spec.class_name_is_native(prop_cls_name):
-                    prop_cls = fhirclass.FHIRClass.with_name(prop_cls_name)
+                    prop_cls = self.spec.class_with_name(prop_cls_name)
                     if prop_cls is None:
                         raise Exception('There is no class "{}" for property "{}" on "{}" in {}'.format(prop_cls_name, prop.name, klass.name, self.name))
                     else:
@@ -373,7 +650,7 @@ class FHIRStructureDefinition(object):
         # assign all super-classes as objects
         for cls in self.classes:
             if cls.superclass is None:
-                super_cls = fhirclass.FHIRClass.with_name(cls.superclass_name)
+                super_cls = self.spec.class_with_name(cls.superclass_name)
                 if super_cls is None and cls.superclass_name is not None:
                     raise Exception('There is no class implementation for class named "{}" in profile "{}"'
                         .format(cls.superclass_name, self.url))
@@ -385,15 +662,19 @@ class FHIRStructureDefinition(object):
 
 class FHIRStructureDefinitionStructure(object):
     """ The actual structure of a complete profile.
+    
+    Only the differential's element dictionaries are kept, until the profile
+    has been processed.
     """
     
+    __slots__ = ['profile', 'name', 'base', 'kind', 'subclass_of', 'differential']
+    
     def __init__(self, profile, profile_dict):
         self.profile = profile
         self.name = None
         self.base = None
         self.kind = None
         self.subclass_of = None
-        self.snapshot = None
         self.differential = None
         
         self.parse_from(profile_dict)
@@ -409,8 +690,6 @@ class FHIRStructureDefinitionStructure(object):
             self.subclass_of = self.profile.spec.class_name_for_profile(self.base)
         
         # find element definitions
-        if 'snapshot' in json_dict:
-            self.snapshot = json_dict['snapshot'].get('element', [])
         if 'differential' in json_dict:
             self.differential = json_dict['differential'].get('element', [])
 
@@ -419,6 +698,9 @@ class FHIRStructureDefinitionElement(object):
     """ An element in a profile's structure.
     """
     
+    __slots__ = ['profile', 'path', 'parent', 'children', 'parent_name', 'definition', 'n_min', 'n_max',
+        'is_main_profile_element', 'represents_class', '_superclass_name', '_did_resolve_dependencies']
+    
     def __init__(self, profile, element_dict, is_main_profile_element=False):
         assert isinstance(profile, FHIRStructureDefinition)
         self.profile = profile
@@ -495,7 +777,7 @@ class FHIRStructureDefinitionElement(object):
         subs = []
         cls, did_create = fhirclass.FHIRClass.for_element(self)
         if did_create:
-            logger.debug('Created class "{}"'.format(cls.name))
+            logger.debug('Created class "%s"', cls.name)
             if module is None and self.is_main_profile_element:
                 module = self.profile.spec.as_module_name(cls.name)
             cls.module = module
@@ -528,8 +810,8 @@ class FHIRStructureDefinitionElement(object):
         if self.is_main_profile_element or self.definition is None:
             return None
         
-        if self.definition.slicing:
-            logger.debug('Omitting property "{}" for slicing'.format(self.definition.prop_name))
+        if self.definition.is_sliced:
+            logger.debug('Omitting property "%s" for slicing', self.definition.prop_name)
             return None
         
         # this must be a property
@@ -595,8 +877,14 @@ class FHIRStructureDefinitionElement(object):
 
 class FHIRStructureDefinitionElementDefinition(object):
     """ The definition of a FHIR element.
+    
+    Only keeps what is needed to create classes and properties; comments,
+    constraints and mappings are not used.
     """
     
+    __slots__ = ['element', 'types', 'name', 'prop_name', 'name_reference', 'short', 'formal', 'is_sliced',
+        'representation', '_name_if_class']
+    
     def __init__(self, element, definition_dict):
         self.element = element
         self.types = []
@@ -605,11 +893,9 @@ class FHIRStructureDefinitionElementDefinition(object):
         self.name_reference = None
         self.short = None
         self.formal = None
-        self.comment = None
-        self.constraint = None
-        self.mapping = None
-        self.slicing = None
+        self.is_sliced = False
         self.representation = None
+        self._name_if_class = None
         # TODO: extract "defaultValue[x]", "fixed[x]", "pattern[x]"
         # TODO: handle  "slicing"
         
@@ -628,41 +914,38 @@ class FHIRStructureDefinitionElementDefinition(object):
         self.formal = definition_dict.get('definition')
         if self.formal and self.short == self.formal[:-1]:     # formal adds a trailing period
             self.formal = None
-        self.comment = definition_dict.get('comments')
-        
-        if 'constraint' in definition_dict:
-            self.constraint = FHIRElementConstraint(definition_dict['constraint'])
-        if 'mapping' in definition_dict:
-            self.mapping = FHIRElementMapping(definition_dict['mapping'])
-        if 'slicing' in definition_dict:
-            self.slicing = definition_dict['slicing']
+        
+        self.is_sliced = 'slicing' in definition_dict
         self.representation = definition_dict.get('representation')
     
     def update_from_reference(self, reference_definition):
         self.element = reference_definition.element
         self.types = reference_definition.types
         self.name = reference_definition.name
-        self.constraint = reference_definition.constraint
-        self.mapping = reference_definition.mapping
-        self.slicing = reference_definition.slicing
+        self.is_sliced = reference_definition.is_sliced
         self.representation = reference_definition.representation
+        self._name_if_class = None
     
     def name_if_class(self):
         """ Determines the class-name that the element would have if it was
         defining a class. This means it uses "name", if present, and the last
-        "path" component otherwise.
+        "path" component otherwise. The name is computed once.
         """
-        with_name = self.name or self.prop_name
-        classname = self.element.profile.spec.class_name_for_type(with_name)
-        if self.element.parent is not None:
-            classname = self.element.parent.name_if_class() + classname
-        return classname
+        if self._name_if_class is None:
+            with_name = self.name or self.prop_name
+            classname = self.element.profile.spec.class_name_for_type(with_name)
+            if self.element.parent is not None:
+                classname = self.element.parent.name_if_class() + classname
+            self._name_if_class = classname
+        return self._name_if_class
 
 
 class FHIRElementType(object):
     """ Representing a type of an element.
     """
     
+    __slots__ = ['code', 'profile']
+    
     def __init__(self, type_dict=None):
         self.code = None
         self.profile = None
@@ -675,26 +958,12 @@ class FHIRElementType(object):
         if self.code is not None and not _is_string(self.code):
             raise Exception("Expecting a string for 'code' definition of an element type, got {} as {}"
                 .format(self.code, type(self.code)))
-        self.profiles = type_dict.get('profile')
-        if self.profiles is not None and \
-            (not isinstance(self.profiles, list) or 1 != len(self.profiles)):
+        profiles = type_dict.get('profile')
+        if profiles is not None and \
+            (not isinstance(profiles, list) or 1 != len(profiles)):
             raise Exception("Expecting a list of 1 for 'profile' definition of an element type, got {} in {}"
-                .format(self.profiles, type_dict))
-        self.profile = self.profiles[0] if self.profiles is not None else None
-
-
-class FHIRElementConstraint(object):
-    """ Constraint on an element.
-    """
-    def __init__(self, constraint_arr):
-        pass
-
-
-class FHIRElementMapping(object):
-    """ Mapping FHIR to other standards.
-    """
-    def __init__(self, mapping_arr):
-        pass
+                .format(profiles, type_dict))
+        self.profile = profiles[0] if profiles is not None else None
 
 
 def _is_string(element):
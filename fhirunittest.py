@@ -9,7 +9,10 @@ import json
 import os.path
 
 from logger import logger
+from fhirprofiler import profiler
+import fhirpool
 import fhirclass
+import fhirbundle
 
 
 class FHIRUnitTestController(object):
@@ -22,23 +25,51 @@ class FHIRUnitTestController(object):
         self.files = None
         self.collections = None
     
-    def find_and_parse_tests(self, directory):
-        self.files = FHIRResourceFile.find_all(directory)
+    def find_and_parse_tests(self, source, files=None):
+        """ Creates unit tests from all example files in the spec source, or
+        from the given FHIRResourceFile instances.
         
-        # create tests
-        tests = []
+        Only the resource type is read from every file; only the first files
+        (by name) of each class, up to the size of a collection, are parsed.
+        With `settings.render_jobs` larger than 1, these are parsed and
+        expanded in worker processes. Tests are collected in file order, so
+        the result does not depend on the number of jobs.
+        """
+        self.files = files if files is not None else FHIRResourceFile.find_all(source)
+        
+        # select the files to parse, per class
+        selected = []
+        counts = {}
         for resource in self.files:
-            test = self.unittest_for_resource(resource)
-            if test is not None:
-                tests.append(test)
+            classname = resource.resource_type
+            assert classname
+            klass = self.spec.class_with_name(classname)
+            if klass is None:
+                if not self.settings.only_profiles:         # otherwise expected for examples of other profiles
+                    logger.error('There is no class for "{}"'.format(classname))
+            elif counts.get(klass.name, 0) < FHIRUnitTestCollection.max_tests:
+                counts[klass.name] = counts.get(klass.name, 0) + 1
+                selected.append((resource, klass))
+        
+        # create tests, in worker processes only handing back the test cases
+        if self.settings.render_jobs > 1:
+            calls = [(self.cases_for_resource, (resource, klass.name)) for resource, klass in selected]
+            all_cases = fhirpool.perform(calls, self.settings.render_jobs)
+            tests = []
+            for (resource, klass), cases in zip(selected, all_cases):
+                cases = [FHIRUnitTestCase(path, value, self.spec.class_with_name(classname)) for path, value, classname in cases]
+                tests.append(FHIRUnitTest(self, resource.filepath, None, klass, tests=cases))
+        else:
+            tests = [self.unittest_for_resource(resource, klass) for resource, klass in selected]
         
         # collect per class
         collections = {}
         for test in tests:
-            coll = collections.get(test.klass.name)
+            klass = test.klass
+            coll = collections.get(klass.name)
             if coll is None:
-                coll = FHIRUnitTestCollection(test.klass)
-                collections[test.klass.name] = coll
+                coll = FHIRUnitTestCollection(klass)
+                collections[klass.name] = coll
             coll.add_test(test)
         
         self.collections = [v for k,v in collections.items()]
@@ -46,18 +77,20 @@ class FHIRUnitTestController(object):
     
     # MARK: Utilities
     
-    def unittest_for_resource(self, resource):
-        """ Returns a FHIRUnitTest instance or None for the given resource,
-        depending on if the class to be tested is known.
+    def unittest_for_resource(self, resource, klass):
+        """ Parses the resource file and expands it into a FHIRUnitTest
+        instance for the given class.
         """
-        classname = resource.content.get('resourceType')
-        assert classname
-        klass = fhirclass.FHIRClass.with_name(classname)
-        if klass is None:
-            logger.error('There is no class for "{}"'.format(classname))
-            return None
+        with profiler.measure('unit_tests', resource.name):
+            return FHIRUnitTest(self, resource.filepath, resource.content, klass)
+    
+    def cases_for_resource(self, resource, classname):
+        """ Creates the unit test for the resource in a worker process.
         
-        return FHIRUnitTest(self, resource.filepath, resource.content, klass)
+        :returns: A list of (path, value, class-name) tuples of all test cases
+        """
+        test = self.unittest_for_resource(resource, self.spec.class_with_name(classname))
+        return [(case.path, case.value, case.klass.name) for case in test.tests]
     
     def make_path(self, prefix, key):
         """ Takes care of combining prefix and key into a path.
@@ -72,21 +105,28 @@ class FHIRUnitTestCollection(object):
     """ Represents a FHIR unit test collection, meaning unit tests pertaining to
     a certain data model to be run against local sample files.
     """
+    
+    # let's assume we don't need 100s of unit tests
+    max_tests = 10
+    
     def __init__(self, klass):
         self.klass = klass
         self.tests = []
     
     def add_test(self, test):
         if test is not None:
-            if len(self.tests) < 10:
-                self.tests.append(test)      # let's assume we don't need 100s of unit tests
+            if len(self.tests) < self.__class__.max_tests:
+                self.tests.append(test)
 
 
 class FHIRUnitTest(object):
     """ Unit tests to be run against one data model class.
+    
+    Expands the given content into test cases, unless the test cases are
+    given.
     """
-    def __init__(self, controller, filepath, content, klass, prefix=None):
-        assert content and klass
+    def __init__(self, controller, filepath, content, klass, prefix=None, tests=None):
+        assert (content or tests is not None) and klass
         self.controller = controller
         self.filepath = filepath
         self.filename = os.path.basename(filepath)
@@ -94,8 +134,9 @@ class FHIRUnitTest(object):
         self.klass = klass
         self.prefix = prefix
         
-        self.tests = None
-        self.expand()
+        self.tests = tests
+        if tests is None:
+            self.expand()
     
     def expand(self):
         """ Expand into a list of FHIRUnitTestCase instances.
@@ -111,7 +152,7 @@ class FHIRUnitTest(object):
                 logger.warning('Unknown property "{}" in unit test on {} in {}'
                     .format(path, self.klass.name, self.filepath))
             else:
-                propclass = fhirclass.FHIRClass.with_name(prop.class_name)
+                propclass = self.controller.spec.class_with_name(prop.class_name)
                 if propclass is None:
                     path = "{}.{}".format(self.prefix, prop.name) if self.prefix else prop.name
                     logger.error('There is no class "{}" for property "{}" in {}'
@@ -198,21 +239,39 @@ class FHIRResourceFile(object):
     """ A FHIR example resource file.
     """
     @classmethod
-    def find_all(cls, directory):
-        """ Finds all example JSON files in the given directory.
+    def find_all(cls, source):
+        """ Finds all example JSON files in the given spec source, sorted by
+        name.
         """
-        assert os.path.isdir(directory)
         all_tests = []
-        for utest in glob.glob(os.path.join(directory, '*-example*.json')):
+        for utest in source.names('*-example*.json'):
             if 'canonical.json' not in utest:
-                all_tests.append(cls(filepath=utest))
+                all_tests.append(cls(source, utest))
         
         return all_tests
     
-    def __init__(self, filepath):
-        self.filepath = filepath
+    def __init__(self, source, name):
+        self.source = source
+        self.name = name
+        self.filepath = source.path_of(name)
+        self._resource_type = None
         self._content = None
     
+    @property
+    def resource_type(self):
+        """ The resource type of the example, only read from the start of
+        the file unless the file has been parsed already.
+        """
+        if self._resource_type is None:
+            if self._content is not None:
+                self._resource_type = self._content.get('resourceType')
+            else:
+                with self.source.open(self.name) as handle:
+                    reader = fhirbundle.FHIRBundleReader(handle)
+                    reader.chunk_size = 4096
+                    self._resource_type = reader.read_member('resourceType')
+        return self._resource_type
+    
     @property
     def content(self):
         """ Process the unit test file, determining class structure
@@ -221,10 +280,9 @@ class FHIRResourceFile(object):
         :returns: A tuple with (top-class-name, [test-dictionaries])
         """
         if self._content is None:
-            logger.info('Parsing unit test {}'.format(os.path.basename(self.filepath)))
+            logger.info('Parsing unit test %s', self.name)
             utest = None
-            assert os.path.exists(self.filepath)
-            with io.open(self.filepath, 'r', encoding='utf-8') as handle:
+            with self.source.open(self.name) as handle:
                 utest = json.load(handle)
             assert utest
             self._content = utest
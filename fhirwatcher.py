@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import importlib
+
+from logger import logger
+import fhirspec
+
+
+class FHIRWatcher(object):
+    """ Keeps parsed specs in memory and rewrites their output whenever one
+    of the files they were generated from changes.
+
+    Output is written incrementally (see `FHIRManifest`), so a changed
+    template only re-renders the files generated from it and a changed manual
+    profile or unit test file is only copied again. A change to the settings
+    or mappings re-parses the spec from the source held in memory. Renders
+    depend on mapping entries only through the classes they render (see
+    `FHIRClass.signature()`), so a changed entry only re-renders the files
+    using it; changing any other setting re-renders all files.
+    """
+
+    # seconds between checking files for changes
+    interval = 0.25
+
+    def __init__(self, specs, outputs, configures):
+        """
+        :param specs: The parsed FHIRSpec instances
+        :param outputs: The output directory for each spec
+        :param configures: A callable for each spec that applies the command
+            line options to its (reloaded) settings module and returns it
+        """
+        self.specs = specs
+        self.outputs = outputs
+        self.configures = configures
+        self._mtimes = {}
+
+    def run(self):
+        """ Watches until interrupted.
+        """
+        self.check_files()
+        logger.warning('Watching {} files for changes, press Ctrl-C to stop'.format(len(self._mtimes)))
+        try:
+            while True:
+                time.sleep(self.__class__.interval)
+                changed = self.check_files()
+                if len(changed) > 0:
+                    self.update(changed)
+        except KeyboardInterrupt:
+            pass
+
+    def update(self, changed):
+        """ Re-parses specs whose settings or mappings changed and rewrites
+        the output of all specs.
+        """
+        start = time.perf_counter()
+        for idx, spec in enumerate(self.specs):
+            try:
+                modules = self.modules_of(spec.settings)
+                if any(module.__file__ in changed for module in modules):
+                    self.specs[idx] = self.reparse(idx, modules)
+                self.specs[idx].write(self.outputs[idx])
+            except Exception as e:
+                logger.error('Failed to update {}: {}'.format(self.outputs[idx], e))
+        self.check_files()      # settings may now name other files
+        logger.warning('Updated after changes to {} in {:.3f} seconds'.format(', '.join(sorted(changed)), time.perf_counter() - start))
+
+    def reparse(self, idx, modules):
+        """ Reloads the mappings and settings of a spec and parses it again
+        from the spec source, logging which mapping entries changed.
+        """
+        before = [self.public_values(module) for module in modules]
+        for module in modules:
+            importlib.reload(module)
+        settings = self.configures[idx]()
+
+        # settings star-import the mappings, only log their own entries once
+        logged = set()
+        for module, values in zip(modules, before):
+            after = self.public_values(module)
+            for name in self.changed_entries(values, after):
+                if name not in logged:
+                    logger.info('Changed {}.{}'.format(module.__name__, name))
+                    logged.add(name)
+
+        spec = fhirspec.FHIRSpec(self.specs[idx].source, settings)
+        if settings.write_unittests:
+            spec.parse_unit_tests()
+        return spec
+
+
+    # MARK: Files
+
+    def modules_of(self, settings):
+        """ The mappings module imported by the settings, if any, and the
+        settings module, in the order they need to be reloaded.
+        """
+        modules = []
+        mappings = sys.modules.get(settings.__name__.rsplit('.', 1)[0] + '.mappings')
+        if mappings is not None:
+            modules.append(mappings)
+        modules.append(settings)
+        return modules
+
+    def watched_files(self):
+        files = set()
+        for spec in self.specs:
+            settings = spec.settings
+            files.update([settings.tpl_resource_source, settings.tpl_factory_source, settings.tpl_unittest_source])
+            files.update([settings.tpl_unittest_manifest_source, settings.tpl_unittest_runner_source])
+            files.update(filepath for filepath, module, contains in settings.manual_profiles)
+            files.update(settings.unittest_copyfiles or [])
+            files.update(module.__file__ for module in self.modules_of(settings))
+        return sorted(path for path in files if path)
+
+    def check_files(self):
+        """ Returns the files that changed since the last check.
+        """
+        changed = set()
+        mtimes = {}
+        for path in self.watched_files():
+            try:
+                stat = os.stat(path)
+                mtimes[path] = (stat.st_mtime, stat.st_size)
+            except OSError:
+                mtimes[path] = None
+            if path in self._mtimes and mtimes[path] != self._mtimes[path]:
+                changed.add(path)
+        self._mtimes = mtimes
+        return changed
+
+
+    # MARK: Mapping Entries
+
+    def public_values(self, module):
+        values = {}
+        for key, val in vars(module).items():
+            if not key.startswith('_') and not hasattr(val, '__dict__'):        # skip imported modules
+                values[key] = val.copy() if isinstance(val, (dict, list, set)) else val
+        return values
+
+    def changed_entries(self, before, after):
+        """ Names of the changed values, for dictionaries naming the changed
+        keys.
+        """
+        changed = []
+        for key in sorted(set(before.keys()) | set(after.keys())):
+            old = before.get(key)
+            new = after.get(key)
+            if old == new:
+                continue
+            if isinstance(old, dict) and isinstance(new, dict):
+                for entry in sorted(set(old.keys()) | set(new.keys())):
+                    if old.get(entry) != new.get(entry):
+                        changed.append('{}[{!r}]'.format(key, entry))
+            else:
+                changed.append(key)
+        return changed
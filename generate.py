@@ -6,9 +6,18 @@
 
 import sys
 import os
+import logging
+from concurrent import futures
+from logger import logger
+from fhirprofiler import profiler
+import fhirpool
 import fhirloader
 import fhirspec
+import fhirrenderer
+import fhiroutput
+import fhirsnapshot
 import argparse
+import functools
 
 
 def args():
@@ -17,32 +26,152 @@ def args():
     parser.add_argument('-r', '--resources', action='store_true', help='Generate resource models')
     parser.add_argument('-e', '--element_factory', action='store_true', help='Generate elementfactory')
     parser.add_argument('-t', '--tests', action='store_true', help='Generate tests')
-    parser.add_argument('--ln', required=True, help='Choose the language', choices=['python', 'swift'])
+    parser.add_argument('--ln', required=True, nargs='+', help='Choose the language(s); with several, each is written to a subdirectory of the output', choices=['python', 'swift'])
     parser.add_argument('--cache', help='The path to the directory with all downloaded files', default='downloads')
-    parser.add_argument('--output', help='The path to the directory with all generated models', default='models')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes to process profiles, parse examples and render models and tests with')
+    parser.add_argument('-d', '--deterministic', action='store_true', help='Pin the generation date to the spec build date')
+    parser.add_argument('-i', '--incremental', action='store_true', help='Only write files whose inputs have changed, removing stale files')
+    parser.add_argument('-s', '--snapshot', action='store_true', help='Keep a snapshot of the parsed spec in the cache directory and use it on later runs')
+    parser.add_argument('--only', metavar='NAMES', help='Comma-separated names of the only profiles to generate, e.g. "Patient,Observation", along with all profiles they depend on')
+    parser.add_argument('-w', '--watch', action='store_true', help='Keep running and rewrite the output whenever templates, settings, mappings or copied files change; implies --incremental')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only log warnings and errors, skipping all per-item log messages')
+    parser.add_argument('--profile', action='store_true', help='Measure time and memory per phase, profile and template and print a summary')
+    parser.add_argument('--profile-stats', metavar='FILE', help='Write cProfile statistics of the main process to FILE, for use with pstats; implies --profile')
+    parser.add_argument('--profile-trace', metavar='FILE', help='Write all measurements as a JSON trace to FILE; implies --profile')
+    parser.add_argument('--output', help='The path to the directory with all generated models, or to a zip archive to write them to', default='models')
+    parser.add_argument('--spec', nargs=2, action='append', metavar=('URL', 'OUTPUT'),
+        help='Generate from the spec at URL into OUTPUT instead of using settings and --output; repeat to generate several specs concurrently')
     return parser
 
 
-if '__main__' == __name__:
-    params = vars(args().parse_args())
-
-    if params['ln'] == 'python':
+def configure(params, ln):
+    """ Imports the settings of the given language and applies the command
+    line options to them.
+    """
+    if ln == 'python':
         from Python import settings
         settings.write_resources = params['resources']
         settings.write_factory = params['element_factory']
         settings.write_unittests = params['tests']
-    elif params['ln'] == 'swift':
+    elif ln == 'swift':
         from Swift import settings
         settings.write_resources = params['resources']
         settings.write_factory = params['resources']
         settings.write_unittests = params['tests']
     else:
         sys.exit(1)
+    settings.render_jobs = params['jobs']
+    settings.deterministic = params['deterministic']
+    settings.incremental = params['incremental'] or params['watch']
+    if params['only']:
+        settings.only_profiles = [name.strip() for name in params['only'].split(',') if name.strip()]
+    return settings
+
 
+def generate(params, spec_url=None, output=None):
+    """ Downloads, parses and writes one FHIR spec. If a spec URL is given,
+    it overrides the one in settings.
+    
+    With several languages the spec is parsed once for all of them (see
+    `FHIRSpec.read_shared`) and the languages are written concurrently.
+    
+    :returns: The profiler's measurements taken during this call, needed
+        when running in a worker process
+    """
+    if params['quiet']:
+        logger.setLevel(logging.WARNING)
+        logging.root.setLevel(logging.WARNING)      # also for other libraries' loggers, like urllib3's
+    profiler.enabled = params['profile']
+    mark = len(profiler.measurements)
+    
+    languages = params['ln']
+    all_settings = [configure(params, ln) for ln in languages]
+    cache = params['cache']
+    if spec_url is not None:
+        for settings in all_settings:
+            settings.specification_url = spec_url
+    output = os.path.expanduser(output or params['output'])
+    outputs = [os.path.join(output, ln) for ln in languages] if len(languages) > 1 else [output]
+    if output.endswith('.zip'):
+        if len(languages) > 1 or params['watch']:
+            raise Exception('Writing to a zip archive works with a single language and without --watch')
+        outputs = [fhiroutput.FHIRZipOutput(output)]
+    
     # assure we have all files
-    loader = fhirloader.FHIRLoader(settings, params['cache'])
-    spec_source = loader.load(params['force'])
+    loader = fhirloader.FHIRLoader(all_settings[0], cache)
+    with profiler.measure('download'):
+        spec_source = loader.load(params['force'])
+    fhirrenderer.use_bytecode_cache(os.path.join(cache, 'templates'))
+    
+    # load parsed specs from snapshots, parse the others
+    specs = [None] * len(languages)
+    snapshots = [None] * len(languages)
+    if params['snapshot']:
+        for idx, settings in enumerate(all_settings):
+            snapshots[idx] = fhirsnapshot.FHIRSpecSnapshot(loader.snapshot_directory, spec_source, settings)
+            specs[idx] = snapshots[idx].load()
+    missing = [idx for idx, spec in enumerate(specs) if spec is None]
+    with profiler.measure('parse'):
+        if len(missing) > 1:
+            parsed = fhirspec.FHIRSpec.read_shared(spec_source, [all_settings[idx] for idx in missing])
+            for idx, spec in zip(missing, parsed):
+                specs[idx] = spec
+        elif len(missing) > 0:
+            specs[missing[0]] = fhirspec.FHIRSpec(spec_source, all_settings[missing[0]])
+    
+    # parse unit tests up front so example files are only read once, then write
+    with profiler.measure('unit_tests'):
+        for spec in specs:
+            if spec.settings.write_unittests and spec.unit_tests is None:
+                spec.parse_unit_tests()
+        
+        # generated unit tests read their example files from FHIR_UNITTEST_DATADIR
+        names = set(test.filename for spec in specs if spec.settings.write_unittests
+            for coll in spec.unit_tests for test in coll.tests)
+        if len(names) > 0:
+            count = spec_source.extract_to(loader.examples_directory, names)
+            logger.info('Extracted {} example files, set FHIR_UNITTEST_DATADIR to {} to run the unit tests'
+                .format(count, os.path.abspath(loader.examples_directory)))
+    fhirpool.perform([(spec.write, (out,)) for spec, out in zip(specs, outputs)], len(specs))
+    
+    # snapshot after writing so that parsed unit tests are included
+    for spec, snapshot in zip(specs, snapshots):
+        if snapshot is not None:
+            snapshot.save(spec)
+    
+    if params['watch']:
+        import fhirwatcher
+        configures = [functools.partial(configure, params, ln) for ln in languages]
+        fhirwatcher.FHIRWatcher(specs, outputs, configures).run()
+    return profiler.measurements[mark:]
 
-    # parse
-    spec = fhirspec.FHIRSpec(spec_source, settings)
-    spec.write(os.path.expanduser(params['output']))
+
+if '__main__' == __name__:
+    params = vars(args().parse_args())
+    params['profile'] = params['profile'] or params['profile_stats'] is not None or params['profile_trace'] is not None
+    specs = params['spec'] or []
+    if params['watch'] and len(specs) > 1:
+        args().error('--watch can only be used with a single --spec')
+    
+    stats = None
+    if params['profile_stats']:
+        import cProfile
+        stats = cProfile.Profile()
+        stats.enable()
+    
+    if len(specs) <= 1:
+        generate(params, *(specs[0] if specs else []))
+    
+    # one process per spec, each spec has its own class registry
+    else:
+        with futures.ProcessPoolExecutor(len(specs)) as executor:
+            for measurements in executor.map(generate, [params] * len(specs), [url for url, output in specs], [output for url, output in specs]):
+                profiler.measurements.extend(measurements)
+    
+    if stats is not None:
+        stats.disable()
+        stats.dump_stats(params['profile_stats'])
+    if params['profile_trace']:
+        profiler.write_trace(params['profile_trace'])
+    if params['profile']:
+        profiler.report()